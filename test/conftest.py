@@ -8,19 +8,41 @@ meaning our db is self contained for the testing sessions.
 Pretty much boilerplate from https://sqlmodel.tiangolo.com/tutorial/fastapi/tests/#client-fixture
 
 conftest.py is some pytest dependency injection magic.
+
+To keep things fast:
+
+  * The database is built and seeded once per test session (the
+    engine fixture).  Each test then runs inside a SAVEPOINT that is
+    rolled back afterwards, so tests can't see each others changes.
+  * Passwords are hashed with a cheap scheme, set by the
+    TEST_HASH_SCHEME environment variable ("bcrypt" with the minimum
+    rounds by default, or "plaintext" for speed).
+  * The database is in memory, so each pytest-xdist worker gets its
+    own copy, and tests can be run in parallel with ``pytest -n auto``
+  * The audit log and revoked tokens go to temporary files, again
+    one per worker.
 """
 
+import contextlib
 import logging
+import os
 
 import pytest
 
 from fastapi.testclient import TestClient
+from sqlalchemy import create_engine as sa_create_engine, event
 from sqlmodel import SQLModel, Session, create_engine
 from sqlmodel.pool import StaticPool
 
 from webapp.main import app
 
+from webapp import registry
+from webapp import database
 from webapp.database import get_session
+from webapp.users import models as user_models
+from webapp.audit import service as audit_service
+from webapp.auth import revocation
+from webapp.search import service as search_service
 
 # And our utilites
 from test import utils
@@ -30,12 +52,60 @@ logging.getLogger("passlib").setLevel(logging.ERROR)
 # Reduce log level of https to remove noise
 logging.getLogger("httpx").setLevel(logging.ERROR)
 
+TEST_HASH_SCHEMES = {
+    "bcrypt": {"schemes": ["bcrypt"], "deprecated": "auto", "bcrypt__rounds": 4},
+    "plaintext": {"schemes": ["plaintext"]},
+}
 
-@pytest.fixture(name="session")
-def session_fixture():
+
+@pytest.fixture(scope="session", autouse=True)
+def cheap_hashing():
     """
-    Overload the get_session dependency to give us
-    an independent testing database.
+    Use a low cost hashing scheme for the test session.
+
+    This is NOT safe for anything other than testing.
+    """
+    scheme = os.environ.get("TEST_HASH_SCHEME", "bcrypt")
+    original = user_models.pwd_context_settings
+    user_models.configure_pwd_context(**TEST_HASH_SCHEMES[scheme])
+    yield
+    user_models.configure_pwd_context(**(original or {}))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def audit_log(tmp_path_factory):
+    """
+    Write the audit log to a temporary file, rather than audit.db
+    """
+    audit_file = tmp_path_factory.mktemp("audit") / "audit.db"
+    registry.register("audit_engine", lambda: sa_create_engine(
+        f"sqlite:///{audit_file}", connect_args={"check_same_thread": False}))
+    audit_service.writer.start()
+    yield audit_service.writer
+    audit_service.writer.stop()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def revocation_store(tmp_path_factory):
+    """
+    Keep revoked tokens in a temporary file, rather than revoked.db
+    """
+    revoked_file = tmp_path_factory.mktemp("revoked") / "revoked.db"
+
+    def build_engine():
+        engine = sa_create_engine(f"sqlite:///{revoked_file}",
+                                  connect_args={"check_same_thread": False})
+        revocation.create_tables(engine)
+        return engine
+
+    registry.register("revocation_engine", build_engine)
+    yield revocation.revocations
+
+
+@pytest.fixture(scope="session", name="engine")
+def engine_fixture(cheap_hashing):
+    """
+    Create and seed the testing database, once per session.
 
     The Database is in memory to avoid writing to disk
     """
@@ -44,15 +114,41 @@ def session_fixture():
         "sqlite://", echo=False, connect_args={"check_same_thread": False}, poolclass=StaticPool
     )
 
+    # pysqlite's own transaction handling breaks SAVEPOINT,
+    # so turn it off and emit BEGIN ourselves.
+    # See https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#serializable-isolation-savepoints-transactional-ddl
+    @event.listens_for(engine, "connect")
+    def do_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def do_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
     SQLModel.metadata.create_all(engine)
+    search_service.create_search_indexes(engine)
 
     with Session(engine) as session:
         utils.create_db(session)
+
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(name="session")
+def session_fixture(engine):
+    """
+    Overload the get_session dependency to give us
+    an independent testing database.
+
+    See utils.rolled_back_session, nothing a test does is kept.
+    """
+    with utils.rolled_back_session(engine) as session:
         yield session
 
 
 @pytest.fixture(name="client")
-def client_fixture(session: Session):
+def client_fixture(session: Session, monkeypatch):
     """
     Fixture to setup the web client.
 
@@ -64,6 +160,8 @@ def client_fixture(session: Session):
         return session
 
     app.dependency_overrides[get_session] = get_session_override
+    # Sessions opened outside a request (eg. the background rehash)
+    monkeypatch.setattr(database, "new_session", lambda: contextlib.nullcontext(session))
     client = TestClient(app)
     yield client
 
@@ -0,0 +1,111 @@
+"""
+Audit log writer, queries, and who made a change
+"""
+
+import datetime
+import time
+import uuid
+
+from webapp.audit import service as audit_service
+from webapp.auth import service as auth_service
+
+from test import utils
+
+
+def _unique_event():
+    # The audit file is shared by the whole test session
+    return f"test_{uuid.uuid4().hex}"
+
+
+def _wait_for(event, count, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        found = audit_service.query_events(event=event)
+        if len(found) >= count:
+            return found
+        time.sleep(0.01)
+    return audit_service.query_events(event=event)
+
+
+def test_full_batch_written_before_interval():
+    writer = audit_service.AuditWriter(batch_size=3, flush_interval=60)
+    writer.start()
+    try:
+        event = _unique_event()
+        for _ in range(3):
+            writer.record(event)
+        assert len(_wait_for(event, 3)) == 3
+    finally:
+        writer.stop()
+
+
+def test_stop_flushes_without_waiting():
+    writer = audit_service.AuditWriter(batch_size=100, flush_interval=60)
+    writer.start()
+    event = _unique_event()
+    writer.record(event)
+
+    start = time.monotonic()
+    writer.stop()
+    assert time.monotonic() - start < 1.0
+    assert len(audit_service.query_events(event=event)) == 1
+
+
+def test_flush_does_not_wait_for_interval(audit_log):
+    event = _unique_event()
+    audit_log.record(event)
+
+    start = time.monotonic()
+    audit_log.flush()
+    assert time.monotonic() - start < audit_service.AUDIT_FLUSH_INTERVAL / 2
+    assert len(audit_service.query_events(event=event)) == 1
+
+
+def test_query_filters(audit_log):
+    event = _unique_event()
+    first, second = uuid.uuid4(), uuid.uuid4()
+    before = datetime.datetime.now(datetime.timezone.utc)
+    audit_log.record(event, actor=first)
+    audit_log.record(event, actor=second)
+    audit_log.record(event, actor=first)
+    audit_log.flush()
+    after = datetime.datetime.now(datetime.timezone.utc)
+
+    assert len(audit_service.query_events(event=event)) == 3
+    assert len(audit_service.query_events(event=event, actor=str(first))) == 2
+    assert len(audit_service.query_events(event=event, start=before, end=after)) == 3
+    assert audit_service.query_events(event=event, end=before) == []
+    assert audit_service.query_events(event=event, start=after) == []
+    assert len(audit_service.query_events(event=event, limit=1)) == 1
+
+
+def test_user_change_records_actor(client, session, audit_log):
+    admin = utils.get_user(session, utils.ADMIN_EMAIL)
+    response = client.post("/token", data={"username": utils.ADMIN_EMAIL,
+                                           "password": utils.ADMIN_PASSWORD})
+    token = response.json()["access_token"]
+
+    response = client.post("/api/users/",
+                           json={"name": "Audited", "email": "audited@example.com",
+                                 "password": "audited", "admin": False},
+                           headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    new_id = response.json()["id"]
+
+    audit_log.flush()
+    events = [event for event in audit_service.query_events(event="user_created", limit=1000)
+              if event.target == str(uuid.UUID(new_id))]
+    assert len(events) == 1
+    assert events[0].actor == str(admin.id)
+
+
+def test_query_limit_is_checked(client, session):
+    admin = utils.get_user(session, utils.ADMIN_EMAIL)
+    token = auth_service.create_access_token(data={"sub": admin.id.hex})
+    headers = {"Authorization": f"Bearer {token}"}
+
+    for limit in (-1, 0, 1001):
+        response = client.get("/api/audit/", params={"limit": limit}, headers=headers)
+        assert response.status_code == 422
+    response = client.get("/api/audit/", params={"limit": 1000}, headers=headers)
+    assert response.status_code == 200
@@ -0,0 +1,236 @@
+"""
+Live events: the broker, slow subscribers, and who sees what
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from webapp.auth import service as auth_service
+from webapp.events import routes as event_routes
+from webapp.events import service as events
+
+from test import utils
+
+
+def _headers(user):
+    token = auth_service.create_access_token(data={"sub": user.id.hex})
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def _next(iterator, timeout=1.0):
+    return await asyncio.wait_for(anext(iterator), timeout)
+
+
+def test_broker_delivers_by_topic():
+    async def run():
+        broker = events.Broker()
+        modules = broker.subscribe(["modules"])
+        everything = broker.subscribe()
+        broker.publish("users", "user_created", {"id": "1"})
+        broker.publish("modules", "module_created", {"module_id": "2"})
+
+        assert (await asyncio.wait_for(modules.get(), 1))["event"] == "module_created"
+        assert (await asyncio.wait_for(everything.get(), 1))["event"] == "user_created"
+        assert (await asyncio.wait_for(everything.get(), 1))["event"] == "module_created"
+
+        assert broker.subscriber_count == 2
+        broker.unsubscribe(modules)
+        broker.unsubscribe(everything)
+        assert broker.subscriber_count == 0
+
+    asyncio.run(run())
+
+
+def test_slow_subscriber_drops_oldest():
+    async def run():
+        broker = events.Broker()
+        subscriber = broker.subscribe(buffer_size=3)
+        for i in range(5):
+            broker.publish("modules", "module_updated", {"n": i})
+        # Let the fan out run
+        await asyncio.sleep(0)
+
+        assert subscriber.dropped == 2
+        received = [subscriber.queue.get_nowait()["data"]["n"] for _ in range(3)]
+        assert received == [2, 3, 4]
+
+    asyncio.run(run())
+
+
+def test_subscriber_user_filter():
+    async def run():
+        broker = events.Broker()
+        subscriber = broker.subscribe(["modules"], user_id="mine")
+        broker.publish("modules", "module_created", {"user_id": "theirs"})
+        broker.publish("modules", "module_created", {"user_id": "mine"})
+
+        message = await asyncio.wait_for(subscriber.get(), 1)
+        assert message["data"]["user_id"] == "mine"
+        assert subscriber.queue.empty()
+
+    asyncio.run(run())
+
+
+def test_format_sse():
+    message = {"id": "1-1", "topic": "modules", "event": "module_created", "data": {"a": 1}}
+    assert events.format_sse(message) == (
+        'id: 1-1\nevent: module_created\ndata: {"topic": "modules", "a": 1}\n\n')
+
+
+def test_stream_only_sends_own_modules(session):
+    user = utils.get_user(session, utils.USER_EMAIL)
+    admin = utils.get_user(session, utils.ADMIN_EMAIL)
+
+    async def run():
+        response = await event_routes.stream_events(topics=None, user=user, session=session)
+        stream = response.body_iterator
+        assert (await _next(stream)).startswith("retry:")
+
+        events.publish("users", "user_updated", {"id": str(admin.id)})
+        events.publish("modules", "module_created", {"user_id": str(admin.id), "module_name": "Theirs"})
+        events.publish("modules", "module_created", {"user_id": str(user.id), "module_name": "Mine"})
+
+        chunk = await _next(stream)
+        assert "event: module_created" in chunk and '"Mine"' in chunk
+        await stream.aclose()
+
+    asyncio.run(run())
+    assert events.broker.subscriber_count == 0
+
+
+def test_stream_users_topic_is_admin_only(client, session):
+    user = utils.get_user(session, utils.USER_EMAIL)
+    response = client.get("/api/events/stream", params={"topics": "users"}, headers=_headers(user))
+    assert response.status_code == 403
+
+
+def test_stream_needs_login(client):
+    response = client.get("/api/events/stream", follow_redirects=False)
+    assert response.status_code == 301
+
+
+def test_stream_unknown_topic(client, session):
+    admin = utils.get_user(session, utils.ADMIN_EMAIL)
+    response = client.get("/api/events/stream", params={"topics": "nope"}, headers=_headers(admin))
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("method", ["patch", "delete"])
+def test_module_changes_need_owner(client, session, method):
+    user = utils.get_user(session, utils.USER_EMAIL)
+    admin = utils.get_user(session, utils.ADMIN_EMAIL)
+    new_module = {"user_id": str(admin.id), "module_name": "Admin's", "description": "x"}
+
+    assert client.post("/api/module/", json=new_module).status_code == 301
+    assert client.post("/api/module/", json=new_module, headers=_headers(user)).status_code == 403
+
+    response = client.post("/api/module/", json=new_module, headers=_headers(admin))
+    assert response.status_code == 200
+    url = f"/api/module/{response.json()['module_id']}"
+
+    kwargs = {"json": {"complete": True}} if method == "patch" else {}
+    assert client.request(method, url, headers=_headers(user), **kwargs).status_code == 403
+    assert client.request(method, url, headers=_headers(admin), **kwargs).status_code == 200
+
+
+class FakeRedis:
+    """
+    Just enough of redis.Redis for RedisBackend: publishing loops
+    straight back to the subscribed handlers, optionally held up by
+    an event to act like a slow server.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.published = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def publish(self, channel, data):
+        self.release.wait(5)
+        self.published.append(data)
+        handler = self.handlers.get(channel)
+        if handler:
+            handler({"data": data})
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FakePubSub(self)
+
+
+class FakePubSub:
+    def __init__(self, client):
+        self.client = client
+
+    def subscribe(self, **handlers):
+        self.client.handlers.update(handlers)
+
+    def run_in_thread(self, sleep_time=0, daemon=False):
+        return self
+
+    def stop(self):
+        pass
+
+    def close(self):
+        self.client.handlers.clear()
+
+
+def test_redis_backend_round_trip():
+    client = FakeRedis()
+    backend = events.RedisBackend("redis://fake", client=client)
+
+    async def run():
+        broker = events.Broker(backend)
+        subscriber = broker.subscribe(["modules"])
+        broker.publish("modules", "module_created", {"module_name": "Via redis"})
+        message = await asyncio.wait_for(subscriber.get(), 1)
+        assert message["data"]["module_name"] == "Via redis"
+        broker.stop()
+
+    asyncio.run(run())
+    assert len(client.published) == 1
+
+
+def test_redis_publish_does_not_block():
+    client = FakeRedis()
+    client.release.clear()  # Redis is stuck
+    backend = events.RedisBackend("redis://fake", max_queue=2, client=client)
+    broker = events.Broker(backend)
+
+    start = time.monotonic()
+    broker.publish("modules", "module_updated", {"n": 0})
+    # Wait for the sender to pick it up (and get stuck sending it)
+    while not backend.outgoing.empty():
+        time.sleep(0.01)
+    for i in range(1, 5):
+        broker.publish("modules", "module_updated", {"n": i})
+    assert time.monotonic() - start < 0.5
+    # Two more are queued, the rest are dropped
+    assert backend.dropped == 2
+
+    client.release.set()
+    broker.stop()
+    assert len(client.published) == 3
+
+
+def test_module_reads_need_owner(client, session):
+    user = utils.get_user(session, utils.USER_EMAIL)
+    admin = utils.get_user(session, utils.ADMIN_EMAIL)
+    mine = {"user_id": str(user.id), "module_name": "Mine", "description": "x"}
+    theirs = {"user_id": str(admin.id), "module_name": "Theirs", "description": "x"}
+    mine_id = client.post("/api/module/", json=mine, headers=_headers(user)).json()["module_id"]
+    theirs_id = client.post("/api/module/", json=theirs, headers=_headers(admin)).json()["module_id"]
+
+    assert client.get("/api/module/", follow_redirects=False).status_code == 301
+    assert client.get(f"/api/module/{mine_id}", follow_redirects=False).status_code == 301
+
+    listed = client.get("/api/module/", headers=_headers(user)).json()
+    assert [module["module_id"] for module in listed] == [mine_id]
+    listed = client.get("/api/module/", headers=_headers(admin)).json()
+    assert {module["module_id"] for module in listed} == {mine_id, theirs_id}
+
+    assert client.get(f"/api/module/{mine_id}", headers=_headers(user)).status_code == 200
+    assert client.get(f"/api/module/{theirs_id}", headers=_headers(user)).status_code == 403
+    assert client.get(f"/api/module/{mine_id}", headers=_headers(admin)).status_code == 200
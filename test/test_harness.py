@@ -0,0 +1,50 @@
+"""
+Check the test fixtures themselves
+
+Each test runs in a SAVEPOINT that is rolled back, and the seeded
+users are available (with the cheap hashing scheme) in every test.
+"""
+
+from sqlmodel import Session, select
+
+from webapp.users.models import User
+
+from test import utils
+
+SCRATCH_EMAIL = "scratch@example.com"
+
+
+def test_commit_is_rolled_back(engine):
+    """
+    A commit made in a test's session is gone once the test is over,
+    and the seeded users are still there
+    """
+    with utils.rolled_back_session(engine) as session:
+        session.add(User(name="Scratch", email=SCRATCH_EMAIL, password="x", admin=False))
+        session.commit()
+        assert utils.get_user(session, SCRATCH_EMAIL) is not None
+
+    with Session(engine) as fresh:
+        assert utils.get_user(fresh, SCRATCH_EMAIL) is None
+        emails = set(fresh.exec(select(User.email)).all())
+        assert {utils.ADMIN_EMAIL, utils.USER_EMAIL} <= emails
+
+
+def test_login_as_seeded_user(client):
+    """
+    Log in as the seeded user, and use the token
+    """
+    response = client.post("/token", data={"username": utils.USER_EMAIL,
+                                           "password": utils.USER_PASSWORD})
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+
+    response = client.get("/auth_user", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert response.json()["current_user"]["email"] == utils.USER_EMAIL
+
+
+def test_login_wrong_password(client):
+    response = client.post("/token", data={"username": utils.USER_EMAIL,
+                                           "password": "not the password"})
+    assert response.status_code == 401
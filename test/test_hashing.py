@@ -0,0 +1,69 @@
+"""
+Password hashes are upgraded on login, without clobbering changes
+"""
+
+import pytest
+
+from passlib.hash import bcrypt
+
+from webapp.auth import service as auth_service
+from webapp.users import models as user_models
+
+from test import utils
+
+OLD_ROUNDS = 4
+NEW_ROUNDS = 5
+
+
+@pytest.fixture(name="stricter_policy")
+def stricter_policy_fixture():
+    """
+    Raise the bcrypt cost, so OLD_ROUNDS hashes are out of date
+    """
+    original = user_models.pwd_context_settings
+    user_models.configure_pwd_context(schemes=["bcrypt"], deprecated="auto",
+                                      bcrypt__rounds=NEW_ROUNDS,
+                                      bcrypt__min_rounds=NEW_ROUNDS)
+    yield
+    user_models.configure_pwd_context(**(original or {}))
+
+
+def _set_old_hash(session, email, password):
+    user = utils.get_user(session, email)
+    user.password = bcrypt.using(rounds=OLD_ROUNDS).hash(password)
+    session.add(user)
+    session.commit()
+    return user
+
+
+def test_outdated_hash_upgraded_on_login(client, session, stricter_policy):
+    user = _set_old_hash(session, utils.USER_EMAIL, utils.USER_PASSWORD)
+
+    # The rehash runs as a background task, in a session from
+    # database.new_session (pointed at the test database by the client fixture)
+    response = client.post("/token", data={"username": utils.USER_EMAIL,
+                                           "password": utils.USER_PASSWORD})
+    assert response.status_code == 200
+
+    session.refresh(user)
+    assert bcrypt.from_string(user.password).rounds == NEW_ROUNDS
+    assert user.verify_password(utils.USER_PASSWORD)
+
+
+def test_rehash_does_not_overwrite_changed_password(session, stricter_policy):
+    user = _set_old_hash(session, utils.USER_EMAIL, utils.USER_PASSWORD)
+
+    valid, new_hash = user.verify_and_update_password(utils.USER_PASSWORD)
+    assert valid and new_hash
+    old_hash = user.password
+
+    # The password is changed before the rehash is saved
+    user.password = user_models.hash_password("changed")
+    session.add(user)
+    session.commit()
+
+    auth_service.save_rehashed_password(user.id, old_hash, new_hash, session=session)
+
+    session.refresh(user)
+    assert user.verify_password("changed")
+    assert not user.verify_password(utils.USER_PASSWORD)
@@ -0,0 +1,94 @@
+"""
+Token revocation: the Bloom filter, syncing between workers, and logout
+"""
+
+import datetime
+import uuid
+
+from webapp.auth import revocation
+
+from test import utils
+
+
+def _expires(minutes):
+    return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=minutes)
+
+
+def _jti():
+    return uuid.uuid4().hex
+
+
+def test_bloom_filter():
+    bloom = revocation.BloomFilter(capacity=1000, error_rate=0.01)
+    added = [_jti() for _ in range(1000)]
+    for value in added:
+        bloom.add(value)
+
+    # Never a false "no"
+    assert all(value in bloom for value in added)
+    # And about error_rate false "maybe"s when full
+    false_positives = sum(_jti() in bloom for _ in range(10000))
+    assert false_positives < 300
+
+
+def test_revoke(revocation_store):
+    jti = _jti()
+    assert not revocation_store.is_revoked(jti)
+    revocation_store.revoke(jti, _expires(30))
+    assert revocation_store.is_revoked(jti)
+    # Revoking twice is fine
+    revocation_store.revoke(jti, _expires(30))
+
+
+def test_other_worker_sees_revocation_after_sync(revocation_store):
+    other_worker = revocation.RevocationList()
+    other_worker.rebuild()
+
+    jti = _jti()
+    revocation_store.revoke(jti, _expires(30))
+    assert not other_worker.is_revoked(jti)
+
+    other_worker.sync()
+    assert other_worker.is_revoked(jti)
+
+
+def test_prune_and_rebuild_forget_expired(revocation_store):
+    expired, current = _jti(), _jti()
+    revocation_store.revoke(expired, _expires(-1))
+    revocation_store.revoke(current, _expires(30))
+
+    assert revocation_store.prune() >= 1
+    # Gone from the store
+    assert not revocation_store.is_revoked(expired)
+    assert revocation_store.is_revoked(current)
+
+    revocation_store.rebuild()
+    assert expired not in revocation_store.filter
+    assert current in revocation_store.filter
+
+
+def test_logout(client):
+    response = client.post("/token", data={"username": utils.USER_EMAIL,
+                                           "password": utils.USER_PASSWORD})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    assert client.get("/auth_user", headers=headers).status_code == 200
+
+    response = client.post("/logout", headers=headers)
+    assert response.status_code == 200
+
+    # 301 is our "Not Authenticated"
+    response = client.get("/auth_user", headers=headers, follow_redirects=False)
+    assert response.status_code == 301
+
+
+def test_logout_cookie(client):
+    response = client.post("/cookie", data={"username": utils.USER_EMAIL,
+                                            "password": utils.USER_PASSWORD})
+    token = response.json()["access_token"]
+    assert client.cookies.get("access_token") == token
+
+    client.post("/logout")
+    assert client.cookies.get("access_token") is None
+    response = client.get("/auth_user", headers={"Authorization": f"Bearer {token}"},
+                          follow_redirects=False)
+    assert response.status_code == 301
@@ -0,0 +1,158 @@
+"""
+Full text search: keyset paging, type-ahead, who can search what, and
+keeping the indexes up to date cheaply
+"""
+
+import pytest
+
+from sqlalchemy import text
+from sqlmodel import SQLModel, create_engine, select
+from sqlmodel.pool import StaticPool
+
+from webapp.modules.models import Module
+from webapp.search import service as search_service
+from webapp.users.models import User
+
+from test import utils
+
+
+def _add_users(session, names, email_domain="example.com"):
+    users = [User(name=name, email=f"{name.replace(' ', '.').lower()}{i}@{email_domain}",
+                  password="x", admin=False)
+             for i, name in enumerate(names)]
+    session.add_all(users)
+    session.commit()
+    return {str(user.id) for user in users}
+
+
+@pytest.fixture(name="admin_headers")
+def admin_headers_fixture(session):
+    return utils.auth_headers(utils.get_user(session, utils.ADMIN_EMAIL))
+
+
+@pytest.fixture(name="user_headers")
+def user_headers_fixture(session):
+    return utils.auth_headers(utils.get_user(session, utils.USER_EMAIL))
+
+
+def test_paging_has_no_duplicates_or_gaps(client, session, admin_headers):
+    # A mix of tied and different scores
+    names = [f"Pager {i}" for i in range(20)] + [f"Pager Pager {i}" for i in range(7)]
+    expected = _add_users(session, names)
+
+    seen = []
+    after = None
+    while True:
+        params = {"q": "pager", "type": "user", "limit": 5}
+        if after:
+            params["after"] = after
+        page = client.get("/api/search/", params=params, headers=admin_headers).json()
+        seen.extend(result["id"] for result in page["results"])
+        after = page["next_cursor"]
+        if after is None:
+            break
+
+    assert len(seen) == len(set(seen))
+    assert set(seen) == expected
+
+
+def test_bad_cursor(client, admin_headers):
+    response = client.get("/api/search/", params={"q": "pager", "after": "nonsense"},
+                          headers=admin_headers)
+    assert response.status_code == 400
+
+
+def test_typeahead_only_matches_names(client, session, admin_headers):
+    by_name = _add_users(session, ["Zebedee"])
+    _add_users(session, ["Someone Else"], email_domain="zebra.example.com")
+
+    results = client.get("/api/search/typeahead", params={"q": "zeb"}, headers=admin_headers).json()
+    assert {result["id"] for result in results} == by_name
+
+    # Full search looks at email too
+    page = client.get("/api/search/", params={"q": "zeb"}, headers=admin_headers).json()
+    assert len(page["results"]) == 2
+
+
+@pytest.mark.parametrize("url", ["/api/search/", "/api/search/typeahead"])
+def test_search_needs_login(client, url):
+    response = client.get(url, params={"q": "admin"}, follow_redirects=False)
+    assert response.status_code == 301
+
+
+def test_user_search_is_admin_only(client, user_headers):
+    # Searching users matches emails, which PublicUser hides
+    response = client.get("/api/search/", params={"q": "admin", "type": "user"},
+                          headers=user_headers)
+    assert response.status_code == 403
+
+
+def test_non_admins_only_find_their_own_modules(client, session, user_headers, admin_headers):
+    user = utils.get_user(session, utils.USER_EMAIL)
+    admin = utils.get_user(session, utils.ADMIN_EMAIL)
+    mine = Module(user_id=user.id, module_name="Quokka mine", description="x")
+    theirs = Module(user_id=admin.id, module_name="Quokka theirs", description="x")
+    session.add_all([mine, theirs])
+    session.commit()
+
+    page = client.get("/api/search/", params={"q": "quokka", "type": "module"},
+                      headers=user_headers).json()
+    assert [result["id"] for result in page["results"]] == [str(mine.module_id)]
+
+    results = client.get("/api/search/typeahead", params={"q": "quok"}, headers=user_headers).json()
+    assert [(result["type"], result["id"]) for result in results] == [("module", str(mine.module_id))]
+
+    page = client.get("/api/search/", params={"q": "quokka", "type": "module"},
+                      headers=admin_headers).json()
+    assert len(page["results"]) == 2
+
+
+def test_user_index_survives_rowid_changes(session):
+    """
+    VACUUM may renumber the user table's rowids, results must still
+    point at the right users
+    """
+    _add_users(session, ["Rowid Survivor", "Rowid Bystander"])
+    session.connection().exec_driver_sql("UPDATE user SET rowid = rowid + 1000")
+    session.commit()
+
+    survivor = session.exec(select(User).where(User.name == "Rowid Survivor")).one()
+    page = search_service.search(session, "survivor")
+    assert [result.id for result in page.results] == [str(survivor.id)]
+
+
+def _change_cost(user_count):
+    """
+    SQLite VM steps to rename then delete one user, with user_count users
+    """
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    search_service.create_search_indexes(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO user (id, name, email, password, admin) "
+                          "VALUES (:id, :name, :email, 'x', 0)"),
+                     [{"id": f"{i:032x}", "name": f"Name {i}", "email": f"{i}@example.com"}
+                      for i in range(user_count)])
+
+    steps = 0
+
+    def count():
+        nonlocal steps
+        steps += 1
+
+    dbapi_connection = engine.raw_connection()
+    dbapi_connection.set_progress_handler(count, 1)
+    target = f"{user_count // 2:032x}"
+    dbapi_connection.execute("UPDATE user SET name = 'Renamed' WHERE id = ?", (target,))
+    dbapi_connection.execute("DELETE FROM user WHERE id = ?", (target,))
+    dbapi_connection.set_progress_handler(None, 1)
+    dbapi_connection.close()
+    engine.dispose()
+    return steps
+
+
+def test_index_triggers_do_not_scan():
+    # Keyed lookups cost about the same however many users there are,
+    # a scan of the index would grow with them
+    small, large = _change_cost(50), _change_cost(5000)
+    assert large < small * 2, (small, large)
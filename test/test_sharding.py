@@ -0,0 +1,152 @@
+"""
+Consistent hashing, shard routing and rebalancing
+
+These use their own SQLite files (in tmp_path) rather than the
+shared test database.
+"""
+
+import collections
+import uuid
+
+import pytest
+
+from sqlmodel import SQLModel, Session, select
+
+from webapp import rebalance, sharding
+from webapp.modules.models import Module
+from webapp.users.models import User
+
+BASE_FILE = "shard_test.db"
+
+
+def _users(count):
+    return [User(name=f"User {i}", email=f"user{i}@example.com", password="x", admin=False)
+            for i in range(count)]
+
+
+def _module(user, name="Module"):
+    return Module(user_id=user.id, module_name=name, description=f"{name} for {user.name}")
+
+
+def _router(tmp_path, count):
+    router = sharding.ShardRouter(count, str(tmp_path / BASE_FILE))
+    for engine in router.engines.values():
+        SQLModel.metadata.create_all(engine)
+    return router
+
+
+def _contents(tmp_path, count):
+    """
+    {shard_name: ({user ids}, {module user ids})} read straight from each file
+    """
+    router = sharding.ShardRouter(count, str(tmp_path / BASE_FILE))
+    contents = {}
+    for name, engine in router.engines.items():
+        with Session(engine) as session:
+            contents[name] = (set(session.exec(select(User.id)).all()),
+                              set(session.exec(select(Module.user_id)).all()))
+        engine.dispose()
+    return contents
+
+
+def test_shard_file_names():
+    assert sharding.shard_file_name(0) == "database.db"
+    assert sharding.shard_file_name(2) == "database_shard2.db"
+    assert sharding.shard_file_name(1, "data") == "data_shard1"
+
+
+def test_ring_is_stable_and_even():
+    ring = sharding.HashRing(sharding.shard_name(i) for i in range(3))
+    keys = [uuid.uuid4() for _ in range(3000)]
+
+    # Same answer for the same key, whatever form it is in
+    for key in keys[:50]:
+        assert ring.node_for(key) == ring.node_for(str(key)) == ring.node_for(key.hex)
+
+    counts = collections.Counter(ring.node_for(key) for key in keys)
+    assert set(counts) == set(ring.nodes)
+    for count in counts.values():
+        assert 0.2 < count / len(keys) < 0.47
+
+
+def test_adding_a_node_only_moves_keys_to_it():
+    old = sharding.HashRing(sharding.shard_name(i) for i in range(3))
+    new = sharding.HashRing(sharding.shard_name(i) for i in range(4))
+    keys = [uuid.uuid4() for _ in range(3000)]
+
+    moved = [key for key in keys if old.node_for(key) != new.node_for(key)]
+    assert all(new.node_for(key) == "shard3" for key in moved)
+    assert 0.1 < len(moved) / len(keys) < 0.4
+
+
+def test_router_puts_users_and_modules_together(tmp_path):
+    router = _router(tmp_path, 3)
+    users = _users(30)
+    with router.session() as session:
+        for user in users:
+            session.add(user)
+            session.add(_module(user))
+        session.commit()
+        user_ids = [user.id for user in users]
+
+    contents = _contents(tmp_path, 3)
+    for user_id in user_ids:
+        shard = router.shard_for(user_id)
+        assert user_id in contents[shard][0]
+        assert user_id in contents[shard][1]
+    assert sum(len(users) for users, _ in contents.values()) == 30
+    # 30 users over 3 shards, every shard gets some
+    assert all(users for users, _ in contents.values())
+
+
+def test_router_lookups(tmp_path):
+    router = _router(tmp_path, 3)
+    users = _users(12)
+    with router.session() as session:
+        modules = [_module(user) for user in users]
+        session.add_all(users + modules)
+        session.commit()
+        user_ids = [user.id for user in users]
+        module_ids = [module.module_id for module in modules]
+
+    with router.session() as session:
+        # By primary key, modules are found whichever shard they are on
+        for user_id, module_id in zip(user_ids, module_ids):
+            assert session.get(User, user_id).id == user_id
+            assert session.get(Module, module_id).user_id == user_id
+        assert session.get(Module, uuid.uuid4()) is None
+
+        # Other queries run on every shard
+        found = session.exec(select(User).where(User.email == "user7@example.com")).all()
+        assert [user.id for user in found] == [user_ids[7]]
+        assert len(session.exec(select(User)).all()) == 12
+
+    counts = router.scatter_gather(lambda shard: len(shard.exec(select(User)).all()))
+    assert len(counts) == 3 and sum(counts) == 12
+
+
+@pytest.mark.parametrize("old_count, new_count", [(2, 3), (3, 1)])
+def test_rebalance(tmp_path, old_count, new_count):
+    router = _router(tmp_path, old_count)
+    with router.session() as session:
+        users = _users(40)
+        session.add_all(users + [_module(user) for user in users])
+        session.commit()
+        user_ids = {user.id for user in users}
+
+    base = str(tmp_path / BASE_FILE)
+    new_ring = sharding.HashRing(sharding.shard_name(i) for i in range(new_count))
+    expected = sum(1 for user_id in user_ids
+                   if new_ring.node_for(user_id) != router.shard_for(user_id))
+
+    # A dry run counts, but doesn't move anything
+    assert rebalance.rebalance(old_count, new_count, dry_run=True, base_file_name=base) == expected
+    assert rebalance.rebalance(old_count, new_count, base_file_name=base) == expected
+    # Running again has nothing left to do
+    assert rebalance.rebalance(old_count, new_count, base_file_name=base) == 0
+
+    contents = _contents(tmp_path, max(old_count, new_count))
+    for name, (shard_users, shard_modules) in contents.items():
+        assert all(new_ring.node_for(user_id) == name for user_id in shard_users)
+        assert shard_modules == shard_users
+    assert set().union(*(shard_users for shard_users, _ in contents.values())) == user_ids
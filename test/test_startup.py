@@ -0,0 +1,34 @@
+"""
+Cold start budget
+
+Fails if importing the app and running its lifespan start up takes
+longer than WEBAPP_STARTUP_BUDGET seconds.
+"""
+
+import os
+
+import webapp
+from webapp import startup
+
+
+def test_startup_within_budget(tmp_path):
+    """
+    Import plus lifespan start up in a fresh interpreter fits the budget
+    """
+    # Run from a scratch directory, so start up creates its databases
+    # there rather than touching the real ones
+    (tmp_path / "webapp").symlink_to(os.path.dirname(webapp.__file__))
+    timings = startup.measure_startup(cwd=tmp_path, repeat=3)
+    assert timings["total"] < startup.STARTUP_BUDGET, timings
+
+
+def test_heavy_imports_are_lazy():
+    """
+    passlib, jwt and jinja2 should not be imported just by importing the app
+    """
+    result = startup._run(
+        ["-c", "import sys, webapp.main; print(' '.join(sorted(sys.modules)))"]
+    )
+    loaded = set(result.stdout.split())
+    for module in ("passlib", "jwt", "jinja2"):
+        assert module not in loaded
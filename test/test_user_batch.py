@@ -0,0 +1,93 @@
+"""
+Looking up many users at once, and the UserLoader behind it
+"""
+
+import asyncio
+import uuid
+
+from webapp.users import loader as user_loader
+from webapp.users import routes as user_routes
+from webapp.users.models import User
+
+
+def _add_users(session, count):
+    users = [User(name=f"Batch {i}", email=f"batch{i}@example.com", password="x", admin=False)
+             for i in range(count)]
+    session.add_all(users)
+    session.commit()
+    return [str(user.id) for user in users]
+
+
+def test_results_in_order_asked(client, session):
+    first, second, third = _add_users(session, 3)
+    ids = [third, first, second]
+
+    response = client.post("/api/users/batch-get", json={"ids": ids})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["id"] for result in results] == ids
+    assert [result["user"]["id"] for result in results] == ids
+    assert {result["status"] for result in results} == {"found"}
+
+
+def test_get_with_ids_query(client, session):
+    first, second = _add_users(session, 2)
+    response = client.get("/api/users/batch-get", params={"ids": f"{second},{first}"})
+    assert [result["id"] for result in response.json()["results"]] == [second, first]
+
+    # Repeated ids= works too
+    response = client.get("/api/users/batch-get", params=[("ids", first), ("ids", second)])
+    assert [result["id"] for result in response.json()["results"]] == [first, second]
+
+
+def test_duplicates_and_markers(client, session):
+    (user_id,) = _add_users(session, 1)
+    missing = str(uuid.uuid4())
+    ids = [user_id, "not-a-uuid", missing, user_id]
+
+    results = client.post("/api/users/batch-get", json={"ids": ids}).json()["results"]
+    assert [result["id"] for result in results] == ids
+    assert [result["status"] for result in results] == ["found", "invalid", "not_found", "found"]
+    assert results[1]["user"] is None and results[2]["user"] is None
+
+
+def test_too_many_ids(client):
+    ids = [str(uuid.uuid4()) for _ in range(user_routes.MAX_BATCH_IDS + 1)]
+    response = client.post("/api/users/batch-get", json={"ids": ids})
+    assert response.status_code == 400
+
+    response = client.post("/api/users/batch-get", json={"ids": ids[:-1]})
+    assert response.status_code == 200
+
+
+def test_list_users_schema_is_unambiguous(client):
+    schema = client.get("/openapi.json").json()
+    ok = schema["paths"]["/api/users/"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert ok["type"] == "array"
+
+
+def test_loader_batches_and_dedups(session, monkeypatch):
+    ids = [uuid.UUID(user_id) for user_id in _add_users(session, 3)]
+    calls = []
+    fetch_users = user_loader.fetch_users
+
+    def counting_fetch(session, user_ids):
+        calls.append(sorted(user_ids))
+        return fetch_users(session, user_ids)
+
+    monkeypatch.setattr(user_loader, "fetch_users", counting_fetch)
+
+    async def run():
+        loader = user_loader.UserLoader(session)
+        # Separate tasks, started together, still share one fetch
+        many, single = await asyncio.gather(
+            loader.load_many([ids[0], ids[1], ids[0]]),
+            loader.load(ids[2]),
+        )
+        assert not loader._tasks
+        return many, single
+
+    many, single = asyncio.run(run())
+    assert [user.id for user in many] == [ids[0], ids[1], ids[0]]
+    assert single.id == ids[2]
+    assert calls == [sorted(ids)]
@@ -1,12 +1,67 @@
-from sqlmodel import select
+import contextlib
+
+from sqlmodel import Session, select
+
+from webapp.auth import service as auth_service
+from webapp.users.models import User, hash_password
+
+# Seed users, available in every test.
+ADMIN_EMAIL = "admin@example.com"
+ADMIN_PASSWORD = "admin"
+USER_EMAIL = "user@example.com"
+USER_PASSWORD = "user"
 
-from webapp.models import User, Message
 
 def create_db(session):
     """
     Wrapper to create data in all tables.
 
     Add your own database init stuff here.
+
+    This runs once per test session (per xdist worker), and each
+    test rolls back anything it changes, so it should be safe to
+    seed as much as you like.
+    """
+
+    session.add(User(name="Admin",
+                     email=ADMIN_EMAIL,
+                     password=hash_password(ADMIN_PASSWORD),
+                     admin=True))
+    session.add(User(name="User",
+                     email=USER_EMAIL,
+                     password=hash_password(USER_PASSWORD),
+                     admin=False))
+    session.commit()
+
+
+def get_user(session, email):
+    """
+    Fetch a seeded user by email
     """
+    qry = select(User).where(User.email == email)
+    return session.exec(qry).first()
 
-    return
+
+@contextlib.contextmanager
+def rolled_back_session(engine):
+    """
+    A session where everything happens inside an outer transaction,
+    using SAVEPOINTs so that commits inside the app still work.
+    The outer transaction is rolled back on exit.
+    """
+    connection = engine.connect()
+    transaction = connection.begin()
+
+    with Session(bind=connection, join_transaction_mode="create_savepoint") as session:
+        yield session
+
+    transaction.rollback()
+    connection.close()
+
+
+def auth_headers(user):
+    """
+    Headers to make a request as this user, without logging in
+    """
+    token = auth_service.create_access_token(data={"sub": user.id.hex})
+    return {"Authorization": f"Bearer {token}"}
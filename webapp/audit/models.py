@@ -0,0 +1,38 @@
+"""
+Audit log models
+
+The audit log lives in its own SQLite file (see audit/service.py), so
+the table is defined with SQLAlchemy Core on a separate MetaData, rather
+than as a SQLModel table that create_all would add to the main database.
+"""
+
+import datetime
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, Text
+from sqlmodel import SQLModel
+
+metadata = MetaData()
+
+audit_event = Table(
+    "audit_event",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("timestamp", DateTime, nullable=False),
+    Column("event", String, nullable=False),
+    Column("actor", String, nullable=True),
+    Column("target", String, nullable=True),
+    Column("detail", Text, nullable=True),
+    # Queries are always over a time range, optionally for one event type / actor
+    Index("ix_audit_event_timestamp", "timestamp"),
+    Index("ix_audit_event_event_timestamp", "event", "timestamp"),
+    Index("ix_audit_event_actor_timestamp", "actor", "timestamp"),
+)
+
+
+class AuditEvent(SQLModel):
+    id: int | None = None
+    timestamp: datetime.datetime
+    event: str
+    actor: str | None = None
+    target: str | None = None
+    detail: str | None = None
@@ -0,0 +1,35 @@
+import datetime
+import logging
+from typing import List
+
+# New Import for API Routers
+from fastapi import APIRouter
+
+# As Main but without FastAPI
+from fastapi import Depends, Query
+
+from webapp.auth import service as auth_service
+from webapp.users.models import User
+
+# Named import of audit Models
+from webapp.audit import models
+from webapp.audit import service
+
+
+log = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.get("/", response_model=List[models.AuditEvent])
+def get_events(*,
+               start: datetime.datetime | None = None,
+               end: datetime.datetime | None = None,
+               event: str | None = None,
+               actor: str | None = None,
+               limit: int = Query(default=100, ge=1, le=1000),
+               user: User = Depends(auth_service.get_admin_user)):
+    """ Get audit events in a time range (admin only) """
+    # Make sure anything still queued shows up
+    service.writer.flush()
+    return service.query_events(start, end, event=event, actor=actor, limit=limit)
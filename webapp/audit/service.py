@@ -0,0 +1,222 @@
+"""
+Audit Logging
+
+Records logins and changes to users, without slowing those requests down.
+
+Handlers call record(), which just puts the event on an in memory queue.
+A background thread writes the queue out in batches, either when
+AUDIT_BATCH_SIZE events are waiting or every AUDIT_FLUSH_INTERVAL
+seconds, to a separate append only SQLite file (WEBAPP_AUDIT_DB).
+
+The queue is bounded, if the writer can't keep up events are dropped
+(and counted) rather than blocking requests.
+
+The writer is started and stopped (with a final flush) by the app's
+lifespan function.
+"""
+
+import datetime
+import logging
+import os
+import queue
+import threading
+
+from sqlalchemy import create_engine, event as sa_event, insert, select, text
+
+from webapp import registry
+from webapp.audit import models
+
+log = logging.getLogger(__name__)
+
+AUDIT_DB = os.environ.get("WEBAPP_AUDIT_DB", "audit.db")
+AUDIT_BATCH_SIZE = 100
+AUDIT_FLUSH_INTERVAL = 1.0  # Seconds
+AUDIT_QUEUE_SIZE = 10000
+
+# Stop anyone (including us) changing history
+_APPEND_ONLY_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS audit_event_no_update
+       BEFORE UPDATE ON audit_event
+       BEGIN SELECT RAISE(ABORT, 'audit log is append only'); END""",
+    """CREATE TRIGGER IF NOT EXISTS audit_event_no_delete
+       BEFORE DELETE ON audit_event
+       BEGIN SELECT RAISE(ABORT, 'audit log is append only'); END""",
+]
+
+
+def _build_engine():
+    engine = create_engine(f"sqlite:///{AUDIT_DB}",
+                           connect_args={"check_same_thread": False})
+
+    @sa_event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        # WAL lets the query endpoint read while the writer appends
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    return engine
+
+registry.register("audit_engine", _build_engine)
+
+
+def create_audit_tables(engine=None):
+    """
+    Create the audit table, indexes and append only triggers
+    """
+    engine = engine or registry.get("audit_engine")
+    models.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for trigger in _APPEND_ONLY_TRIGGERS:
+            conn.execute(text(trigger))
+
+
+class AuditWriter:
+    """
+    Bounded queue of audit events, and the thread that writes them out
+    """
+
+    def __init__(self,
+                 batch_size: int = AUDIT_BATCH_SIZE,
+                 flush_interval: float = AUDIT_FLUSH_INTERVAL,
+                 max_queue: int = AUDIT_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._write_lock = threading.Lock()
+
+    def record(self, event: str, actor=None, target=None, detail=None):
+        """
+        Queue an event.  Never blocks, if the queue is full the event
+        is dropped.
+        """
+        item = {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None),
+            "event": event,
+            "actor": None if actor is None else str(actor),
+            "target": None if target is None else str(target),
+            "detail": detail,
+        }
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            log.warning("Audit queue full, dropped %s event (%s dropped)", event, self.dropped)
+            return
+        if self.queue.qsize() >= self.batch_size:
+            self._wake.set()
+
+    def start(self):
+        """
+        Create the tables and start the background writer
+        """
+        if self._thread is not None:
+            return
+        create_audit_tables()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the writer, and flush anything left in the queue
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def flush(self) -> int:
+        """
+        Write everything currently queued, now.  Returns the number
+        written by this call.
+
+        The background writer only takes events off the queue while
+        holding the write lock, so once we have it nothing recorded
+        before this call is left part way.
+        """
+        written = 0
+        with self._write_lock:
+            while True:
+                batch = self._take(self.batch_size)
+                if not batch:
+                    break
+                self._write(batch)
+                written += len(batch)
+        return written
+
+    def _take(self, count):
+        """
+        Take up to count events off the queue, without waiting
+        """
+        batch = []
+        while len(batch) < count:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            with registry.get("audit_engine").begin() as conn:
+                conn.execute(insert(models.audit_event), batch)
+        except Exception:
+            log.exception("Failed to write %s audit events", len(batch))
+
+    def _run(self):
+        while not self._stop.is_set():
+            # Sleep until a full batch is waiting, we are stopped,
+            # or the flush interval has passed
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+writer = AuditWriter()
+
+
+def record(event: str, actor=None, target=None, detail=None):
+    """
+    Queue an audit event, see AuditWriter.record
+    """
+    writer.record(event, actor=actor, target=target, detail=detail)
+
+
+def query_events(start: datetime.datetime | None = None,
+                 end: datetime.datetime | None = None,
+                 event: str | None = None,
+                 actor: str | None = None,
+                 limit: int = 100):
+    """
+    Return audit events in the time range [start, end), oldest first.
+    """
+    table = models.audit_event
+    qry = select(table)
+    if start is not None:
+        qry = qry.where(table.c.timestamp >= _naive_utc(start))
+    if end is not None:
+        qry = qry.where(table.c.timestamp < _naive_utc(end))
+    if event is not None:
+        qry = qry.where(table.c.event == event)
+    if actor is not None:
+        qry = qry.where(table.c.actor == actor)
+    qry = qry.order_by(table.c.timestamp, table.c.id).limit(limit)
+
+    with registry.get("audit_engine").connect() as conn:
+        rows = conn.execute(qry).mappings().all()
+    return [models.AuditEvent(**row) for row in rows]
+
+
+def _naive_utc(value: datetime.datetime):
+    # Timestamps are stored as naive UTC
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
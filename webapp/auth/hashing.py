@@ -0,0 +1,181 @@
+"""
+Password Hashing Policy
+
+Decides which scheme, and how expensive, our password hashes are.
+The policy is read from environment variables so it can be tuned per
+deployment without code changes:
+
+  WEBAPP_HASH_SCHEME         "bcrypt" (default) or "argon2" (argon2id)
+  WEBAPP_BCRYPT_ROUNDS       bcrypt cost factor (default 12)
+  WEBAPP_ARGON2_TIME_COST    argon2 iterations (default 3)
+  WEBAPP_ARGON2_MEMORY_KB    argon2 memory in KiB (default 65536)
+  WEBAPP_ARGON2_PARALLELISM  argon2 lanes (default 4)
+
+The cost should be calibrated once, on the deployment hardware, and the
+resulting values set for every worker.  (Calibrating in each worker
+would let workers disagree on the minimum cost, and flag each others
+hashes for an update.)
+
+    python -m webapp.auth.hashing --scheme argon2 --target-ms 250
+
+Hashes made with an old scheme or a lower cost are flagged as needing
+an update, and are rehashed the next time that user logs in
+(see auth.service.validate_login), so the policy can be changed
+without a mass password reset.
+
+argon2 needs the optional argon2-cffi package.
+"""
+
+import argparse
+import importlib.util
+import logging
+import os
+import statistics
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SCHEME = "bcrypt"
+DEFAULT_BCRYPT_ROUNDS = 12
+DEFAULT_ARGON2_TIME_COST = 3
+DEFAULT_ARGON2_MEMORY_KB = 65536
+DEFAULT_ARGON2_PARALLELISM = 4
+
+# Limits for the calibration search
+BCRYPT_ROUNDS_RANGE = (10, 16)
+ARGON2_TIME_COST_RANGE = (1, 10)
+
+
+def argon2_available() -> bool:
+    """
+    Is the argon2 backend installed
+    """
+    return importlib.util.find_spec("argon2") is not None
+
+
+def _time_verify(handler, samples=3):
+    """
+    Median time (in ms) to verify a password with a passlib handler
+    """
+    the_hash = handler.hash("calibration password")
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        handler.verify("calibration password", the_hash)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate_bcrypt(target_ms: float) -> int:
+    """
+    Find the lowest bcrypt rounds where a verify takes at least
+    target_ms on this machine.
+    """
+    from passlib.hash import bcrypt
+
+    low, high = BCRYPT_ROUNDS_RANGE
+    for rounds in range(low, high + 1):
+        elapsed = _time_verify(bcrypt.using(rounds=rounds))
+        log.info("bcrypt rounds=%s verify %.1fms", rounds, elapsed)
+        if elapsed >= target_ms:
+            return rounds
+    return high
+
+
+def calibrate_argon2(target_ms: float,
+                     memory_kb: int = DEFAULT_ARGON2_MEMORY_KB,
+                     parallelism: int = DEFAULT_ARGON2_PARALLELISM) -> int:
+    """
+    Find the lowest argon2id time cost where a verify takes at least
+    target_ms on this machine, for a fixed memory and parallelism.
+    """
+    from passlib.hash import argon2
+
+    low, high = ARGON2_TIME_COST_RANGE
+    for time_cost in range(low, high + 1):
+        handler = argon2.using(type="ID",
+                               memory_cost=memory_kb,
+                               parallelism=parallelism,
+                               time_cost=time_cost)
+        elapsed = _time_verify(handler)
+        log.info("argon2 time_cost=%s verify %.1fms", time_cost, elapsed)
+        if elapsed >= target_ms:
+            return time_cost
+    return high
+
+
+def policy_settings(scheme: str | None = None,
+                    bcrypt_rounds: int | None = None,
+                    argon2_time_cost: int | None = None,
+                    argon2_memory_kb: int | None = None,
+                    argon2_parallelism: int | None = None) -> dict:
+    """
+    Build keyword arguments for passlib's CryptContext.
+
+    Anything not given is read from the environment, falling back
+    to the defaults above.
+    """
+    env = os.environ
+    scheme = scheme or env.get("WEBAPP_HASH_SCHEME", DEFAULT_SCHEME)
+
+    if scheme == "argon2" and not argon2_available():
+        log.warning("argon2-cffi is not installed, falling back to bcrypt")
+        scheme = "bcrypt"
+    if scheme not in ("bcrypt", "argon2"):
+        raise ValueError(f"Unknown password hashing scheme {scheme!r}")
+
+    if argon2_memory_kb is None:
+        argon2_memory_kb = int(env.get("WEBAPP_ARGON2_MEMORY_KB", DEFAULT_ARGON2_MEMORY_KB))
+    if argon2_parallelism is None:
+        argon2_parallelism = int(env.get("WEBAPP_ARGON2_PARALLELISM", DEFAULT_ARGON2_PARALLELISM))
+
+    if bcrypt_rounds is None:
+        bcrypt_rounds = int(env.get("WEBAPP_BCRYPT_ROUNDS", DEFAULT_BCRYPT_ROUNDS))
+    if argon2_time_cost is None:
+        argon2_time_cost = int(env.get("WEBAPP_ARGON2_TIME_COST", DEFAULT_ARGON2_TIME_COST))
+
+    # The first scheme is used for new hashes, and with deprecated="auto"
+    # hashes in any of the others are flagged for an update.
+    if scheme == "argon2":
+        schemes = ["argon2", "bcrypt"]
+    else:
+        schemes = ["bcrypt"] + (["argon2"] if argon2_available() else [])
+
+    settings = {
+        "schemes": schemes,
+        "deprecated": "auto",
+        "bcrypt__rounds": bcrypt_rounds,
+        # Hashes below the current cost need updating
+        "bcrypt__min_rounds": bcrypt_rounds,
+    }
+    if "argon2" in schemes:
+        settings.update({
+            "argon2__type": "ID",
+            "argon2__time_cost": argon2_time_cost,
+            "argon2__memory_cost": argon2_memory_kb,
+            "argon2__parallelism": argon2_parallelism,
+        })
+    return settings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Calibrate password hashing cost for this machine")
+    parser.add_argument("--scheme", choices=["bcrypt", "argon2"], default=DEFAULT_SCHEME)
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument("--memory-kb", type=int, default=DEFAULT_ARGON2_MEMORY_KB)
+    parser.add_argument("--parallelism", type=int, default=DEFAULT_ARGON2_PARALLELISM)
+    args = parser.parse_args()
+
+    print(f"WEBAPP_HASH_SCHEME={args.scheme}")
+    if args.scheme == "argon2":
+        time_cost = calibrate_argon2(args.target_ms, args.memory_kb, args.parallelism)
+        print(f"WEBAPP_ARGON2_TIME_COST={time_cost}")
+        print(f"WEBAPP_ARGON2_MEMORY_KB={args.memory_kb}")
+        print(f"WEBAPP_ARGON2_PARALLELISM={args.parallelism}")
+    else:
+        print(f"WEBAPP_BCRYPT_ROUNDS={calibrate_bcrypt(args.target_ms)}")
+
+
+if __name__ == "__main__":
+    main()
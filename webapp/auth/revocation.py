@@ -0,0 +1,215 @@
+"""
+Token Revocation
+
+JWTs are valid until they expire, so logging out (or revoking a stolen
+token) means remembering the token's id (its jti claim) until then.
+
+Checking a database on every request would be slow, so each worker keeps
+an in memory Bloom filter of revoked ids.  A Bloom filter can say "maybe"
+but never gives a false "no", so almost every request is answered from
+memory, and only a possible hit is confirmed against the store.
+
+The store is a small SQLite file (WEBAPP_REVOCATION_DB) shared by all
+workers.  A background thread in each worker:
+
+  * adds revocations made by other workers to its filter, every
+    REVOCATION_SYNC_SECONDS (so another worker's logout may take that
+    long to be seen here, this worker's own logouts apply at once).
+  * deletes entries once their token has expired, and rebuilds the
+    filter every REVOCATION_REBUILD_SECONDS so it doesn't fill up.
+"""
+
+import datetime
+import hashlib
+import logging
+import math
+import os
+import threading
+
+from sqlalchemy import (Column, DateTime, Integer, MetaData, String, Table,
+                        create_engine, delete, insert, select)
+from sqlalchemy.exc import IntegrityError
+
+from webapp import registry
+
+log = logging.getLogger(__name__)
+
+REVOCATION_DB = os.environ.get("WEBAPP_REVOCATION_DB", "revoked.db")
+REVOCATION_SYNC_SECONDS = 2.0
+REVOCATION_REBUILD_SECONDS = 600.0
+
+# Sized for this many revoked (unexpired) tokens at a 0.1% false positive rate
+BLOOM_CAPACITY = 100000
+BLOOM_ERROR_RATE = 0.001
+
+metadata = MetaData()
+
+revoked_token = Table(
+    "revoked_token",
+    metadata,
+    # id gives workers an easy "what's new since" for syncing
+    Column("id", Integer, primary_key=True),
+    Column("jti", String, nullable=False, unique=True),
+    Column("expires_at", DateTime, nullable=False, index=True),
+    # Never reuse ids, or a sync could miss a row
+    sqlite_autoincrement=True,
+)
+
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter over strings
+    """
+
+    def __init__(self, capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str):
+        # Double hashing, two 64 bit hashes give as many as we need
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:], "big") | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(value))
+
+
+def create_tables(engine):
+    metadata.create_all(engine)
+
+
+def _build_engine():
+    engine = create_engine(f"sqlite:///{REVOCATION_DB}",
+                           connect_args={"check_same_thread": False})
+    create_tables(engine)
+    return engine
+
+registry.register("revocation_engine", _build_engine)
+
+
+def _now():
+    # Stored as naive UTC
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class RevocationList:
+    """
+    Revoked token ids: the shared store, plus this worker's Bloom filter
+    """
+
+    def __init__(self):
+        self.filter = BloomFilter()
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._since_rebuild = 0.0
+
+    @property
+    def engine(self):
+        return registry.get("revocation_engine")
+
+    def revoke(self, jti: str, expires_at: datetime.datetime):
+        """
+        Revoke a token id until expires_at
+        """
+        if expires_at.tzinfo is not None:
+            expires_at = expires_at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(revoked_token), {"jti": jti, "expires_at": expires_at})
+        except IntegrityError:
+            # Already revoked
+            pass
+        with self._lock:
+            self.filter.add(jti)
+
+    def is_revoked(self, jti: str) -> bool:
+        """
+        Has this token id been revoked.  Only touches the store if the
+        Bloom filter says it might have been.
+        """
+        if jti not in self.filter:
+            return False
+        qry = select(revoked_token.c.id).where(revoked_token.c.jti == jti)
+        with self.engine.connect() as conn:
+            return conn.execute(qry).first() is not None
+
+    def sync(self):
+        """
+        Add revocations made since we last looked (eg. by other workers)
+        """
+        qry = (select(revoked_token.c.id, revoked_token.c.jti)
+               .where(revoked_token.c.id > self._last_id)
+               .order_by(revoked_token.c.id))
+        with self.engine.connect() as conn:
+            rows = conn.execute(qry).all()
+        with self._lock:
+            for row in rows:
+                self.filter.add(row.jti)
+                self._last_id = row.id
+
+    def prune(self) -> int:
+        """
+        Forget tokens that have expired anyway.  Returns how many.
+        """
+        with self.engine.begin() as conn:
+            result = conn.execute(delete(revoked_token).where(revoked_token.c.expires_at < _now()))
+        return result.rowcount
+
+    def rebuild(self):
+        """
+        Build a fresh filter from the store, dropping expired ids
+        """
+        new_filter = BloomFilter()
+        qry = select(revoked_token.c.id, revoked_token.c.jti).where(revoked_token.c.expires_at >= _now())
+        with self.engine.connect() as conn:
+            rows = conn.execute(qry).all()
+        for row in rows:
+            new_filter.add(row.jti)
+        with self._lock:
+            self.filter = new_filter
+            self._last_id = max([self._last_id] + [row.id for row in rows])
+        # Catch anything revoked while we were building
+        self.sync()
+
+    def start(self):
+        """
+        Load the filter and start the background sync
+        """
+        if self._thread is not None:
+            return
+        self.rebuild()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="revocation-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(REVOCATION_SYNC_SECONDS):
+            try:
+                self.sync()
+                self._since_rebuild += REVOCATION_SYNC_SECONDS
+                if self._since_rebuild >= REVOCATION_REBUILD_SECONDS:
+                    self._since_rebuild = 0.0
+                    pruned = self.prune()
+                    log.info("Pruned %s expired revocations", pruned)
+                    self.rebuild()
+            except Exception:
+                log.exception("Revocation sync failed")
+
+
+revocations = RevocationList()
@@ -11,8 +11,8 @@ import uuid
 
 from typing import Optional, Dict, Annotated
 
-from fastapi import Request, HTTPException, status, Depends
-from sqlmodel import Session, select
+from fastapi import Request, HTTPException, status, Depends, BackgroundTasks
+from sqlmodel import Session, select, update
 
 
 # FastAPI OAUTH2 Imports
@@ -21,12 +21,13 @@ from fastapi.security import OAuth2PasswordBearer
 from fastapi.security.utils import get_authorization_scheme_param
 from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel
 
-# For JWT
-import jwt
-from jwt.exceptions import InvalidTokenError
+# PyJWT is imported inside the functions that use it, to keep
+# start up fast.
 
 from webapp.users.models import User
 from webapp import database
+from webapp.audit import service as audit
+from webapp.auth.revocation import revocations
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.WARNING)
@@ -108,61 +109,147 @@ def create_access_token(
     Create a JWT based token, and return it
     """
 
+    import jwt
+
     to_encode = data.copy()
 
-    expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=JWT_TOKEN_EXPIRES)
-    to_encode.update({"exp": expires})
+    now = datetime.datetime.now(datetime.timezone.utc)
+    expires = now + datetime.timedelta(minutes=JWT_TOKEN_EXPIRES)
+    # jti gives each token an id, so it can be revoked
+    to_encode.update({"exp": expires, "iat": now, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(
         to_encode, JWT_SECRET_KEY, algorithm=JWT_ALG
     )
     return encoded_jwt
 
 
-def decode_token(
+def decode_payload(
     token: str,
-    session: Session,
 ):
     """
-    Decode a token and return the relevant user if they exist.
+    Check a token's signature and expiry, and return its claims,
+    or None if it isn't valid.
     """
     if token is None:
         return None
 
+    import jwt
+    from jwt.exceptions import InvalidTokenError
+
     try:
-        payload = jwt.decode(
+        return jwt.decode(
             token, JWT_SECRET_KEY, algorithms=[JWT_ALG]
         )
-        user_id: str = payload.get("sub", None)
-
     except InvalidTokenError:
         return None
 
+
+def revoke_token(
+    token: str,
+):
+    """
+    Revoke a token so it can't be used again, even before it expires.
+
+    Returns the token's claims, or None if the token wasn't valid anyway.
+    """
+    payload = decode_payload(token)
+    if payload is None or "jti" not in payload:
+        return None
+
+    expires = datetime.datetime.fromtimestamp(payload["exp"], datetime.timezone.utc)
+    revocations.revoke(payload["jti"], expires)
+    return payload
+
+
+def decode_token(
+    token: str,
+    session: Session,
+):
+    """
+    Decode a token and return the relevant user if they exist.
+    (and the token hasn't been revoked)
+    """
+    payload = decode_payload(token)
+    if payload is None:
+        return None
+
+    jti = payload.get("jti")
+    if jti and revocations.is_revoked(jti):
+        return None
+
+    user_id: str = payload.get("sub", None)
     restored_uuid = uuid.UUID(user_id)
     the_user = session.get(User, restored_uuid)
 
     return the_user
 
+def save_rehashed_password(
+    user_id: uuid.UUID,
+    old_hash: str,
+    new_hash: str,
+    session: Session | None = None,
+):
+    """
+    Store an upgraded password hash.
+
+    Only replaces the hash if it hasn't changed since we checked it,
+    so we never clobber a password changed in the meantime.
+
+    As a background task this runs after the request's session has
+    been closed, so without a session we open our own.
+    """
+    qry = (update(User)
+           .where(User.id == user_id)
+           .where(User.password == old_hash)
+           .values(password=new_hash))
+    if session is not None:
+        session.exec(qry)
+        session.commit()
+        return
+    with database.new_session() as own_session:
+        own_session.exec(qry)
+        own_session.commit()
+
+
 def validate_login(
     email: str,
     password: str,
     session: Session,
+    background_tasks: BackgroundTasks | None = None,
 ):
     """
     Validate a login
 
     If the login is correct create a token and return it as a tuple
     of [User, token] otherwise, return [False, Message]
+
+    If the stored hash is out of date with the hashing policy
+    it is rehashed, and saved after the response is sent when
+    background_tasks are given (otherwise straight away).
     """
 
     # Fetch the User from the Database
     qry = select(User).where(User.email == email)
     db_user = session.exec(qry).first()
     if not db_user:
+        audit.record("login_failed", detail=email)
         return False
     # Confirm Password
-    if not db_user.verify_password(password):
+    valid, new_hash = db_user.verify_and_update_password(password)
+    if not valid:
+        audit.record("login_failed", actor=db_user.id, detail=email)
         return False
 
+    audit.record("login", actor=db_user.id)
+
+    if new_hash:
+        log.info("Rehashing password for %s", db_user.id)
+        args = (db_user.id, db_user.password, new_hash)
+        if background_tasks is not None:
+            background_tasks.add_task(save_rehashed_password, *args)
+        else:
+            save_rehashed_password(*args, session=session)
+
     # If we use UUID, our token hates it, so just return he hex
     hex_id = db_user.id.hex
 
@@ -206,3 +293,17 @@ async def get_auth_user(
     
     return the_user
     
+
+
+async def get_admin_user(
+        the_user: User = Depends(get_auth_user),
+):
+    """
+    Return the current user, if they are an admin.
+    Raise a Forbidden Exception otherwise
+    """
+
+    if not the_user.admin:
+        raise HTTPException(403, "Admin Access Required")
+
+    return the_user
@@ -1,14 +1,74 @@
+import os
+
 from sqlmodel import SQLModel, create_engine, Session
 
+from webapp import sharding
+
 sqlite_file_name = "database.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 connect_args = {"check_same_thread": False}
 
+# Number of SQLite files user data is spread over, see webapp/sharding.py
+SHARD_COUNT = int(os.environ.get("WEBAPP_SHARDS", "1"))
+
 engine = create_engine(sqlite_url, echo=True, connect_args=connect_args)
 
+router = sharding.ShardRouter(SHARD_COUNT, sqlite_file_name, first_engine=engine,
+                              echo=True, connect_args=connect_args)
+
+def new_session():
+    """
+    A new session, for work outside of a request (eg. background tasks)
+    """
+    if router.count == 1:
+        return Session(engine)
+    return router.session()
+
 def get_session():
-    with Session(engine) as session:
+    with new_session() as session:
         yield session
 
+def all_engines():
+    """
+    Engine for every shard
+    """
+    return list(router.engines.values())
+
+def scatter_gather(session, fn):
+    """
+    Run fn(session) against every shard in parallel, returning a list
+    of results (one per shard).
+
+    With a normal (unsharded) session, fn is just called with it.
+    """
+    if isinstance(session, sharding.ShardedSession):
+        return router.scatter_gather(fn)
+    return [fn(session)]
+
+def group_by_shard(session, user_ids):
+    """
+    Split user ids up by the shard they live on, as {shard_name: [ids]}
+
+    With a normal (unsharded) session there is one group, keyed None.
+    """
+    if not isinstance(session, sharding.ShardedSession):
+        return {None: list(user_ids)}
+    groups = {}
+    for user_id in user_ids:
+        groups.setdefault(router.shard_for(user_id), []).append(user_id)
+    return groups
+
+def shard_index(session):
+    """
+    Which shard a plain session (eg. from scatter_gather) is for.
+    Always 0 when we aren't sharded.
+    """
+    bind = session.get_bind()
+    for index, shard_engine in enumerate(all_engines()):
+        if bind is shard_engine:
+            return index
+    return 0
+
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine )
\ No newline at end of file
+    for shard_engine in all_engines():
+        SQLModel.metadata.create_all(shard_engine)
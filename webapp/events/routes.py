@@ -0,0 +1,58 @@
+import logging
+
+# New Import for API Routers
+from fastapi import APIRouter
+
+# As Main but without FastAPI
+from fastapi import HTTPException, Depends
+from fastapi.responses import StreamingResponse
+
+from sqlmodel import Session
+
+from webapp import database
+from webapp.auth import service as auth_service
+from webapp.users.models import User
+
+from webapp.events import service
+
+
+log = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.get("/stream")
+async def stream_events(*,
+                        topics: str | None = None,
+                        user: User = Depends(auth_service.get_auth_user),
+                        session: Session = Depends(database.get_session)):
+    """
+    Server Sent Events for module and user changes.
+
+    topics is a comma seperated list, from "modules" and "users"
+    (the default is every topic you are allowed).  "users" is for
+    admins only, and other users only see events for their own modules.
+    """
+    if topics is None:
+        wanted = list(service.TOPICS) if user.admin else ["modules"]
+    else:
+        wanted = [topic.strip() for topic in topics.split(",") if topic.strip()]
+    unknown = set(wanted) - set(service.TOPICS)
+    if unknown or not wanted:
+        raise HTTPException(status_code=400, detail=f"Unknown topics {sorted(unknown)}")
+    if "users" in wanted:
+        await auth_service.get_admin_user(user)
+
+    # Admins see everything, anyone else just events about themselves
+    user_id = None if user.admin else str(user.id)
+
+    # We only needed the database to check the user, don't hold a
+    # connection open for the life of the stream
+    session.close()
+
+    subscriber = service.broker.subscribe(wanted, user_id=user_id)
+    return StreamingResponse(
+        service.sse_stream(subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
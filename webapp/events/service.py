@@ -0,0 +1,306 @@
+"""
+Live Events
+
+Publish / subscribe for pushing changes (modules created, completed or
+deleted, users changed) to dashboards over Server Sent Events, rather
+than them polling the pages.
+
+Each subscriber gets a small bounded buffer.  If a subscriber can't keep
+up, the oldest events are dropped so one slow client can't use up
+memory or hold up anyone else.  An idle subscriber is just a waiting
+asyncio task, so thousands of open connections are cheap.
+
+Where events go between publishers and subscribers is pluggable:
+
+  * LocalBackend (default) delivers inside this process.
+  * RedisBackend uses Redis pub/sub, so events reach subscribers
+    connected to any worker.  Set WEBAPP_EVENTS_URL=redis://host:6379/0
+    (needs the optional redis package).
+
+publish() can be called from anywhere, including sync route handlers
+running in the threadpool.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from typing import Dict, Iterable, Set
+
+log = logging.getLogger(__name__)
+
+EVENTS_URL = os.environ.get("WEBAPP_EVENTS_URL", "")
+EVENTS_CHANNEL = "webapp-events"
+SUBSCRIBER_BUFFER = 100
+HEARTBEAT_SECONDS = 15
+# Events waiting to be sent to Redis, before we start dropping them
+REDIS_QUEUE_SIZE = 10000
+
+TOPICS = ("modules", "users")
+
+
+class Subscriber:
+    """
+    One listener (eg. an open SSE connection)
+    """
+
+    def __init__(self, topics: Iterable[str], buffer_size: int = SUBSCRIBER_BUFFER,
+                 user_id: str | None = None):
+        self.topics = set(topics)
+        # If set, only events about this user (their "user_id") are passed on
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=buffer_size)
+        self.loop = asyncio.get_running_loop()
+        self.dropped = 0
+
+    def wants(self, message) -> bool:
+        """
+        Is this message for us
+        """
+        if message["topic"] not in self.topics:
+            return False
+        return self.user_id is None or message["data"].get("user_id") == self.user_id
+
+    def offer(self, message):
+        """
+        Buffer a message, dropping the oldest if we are full.
+        Must be called from the subscriber's event loop.
+        """
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class LocalBackend:
+    """
+    Deliver events within this process only
+    """
+
+    def __init__(self):
+        self.broker = None
+
+    def start(self, broker):
+        self.broker = broker
+
+    def stop(self):
+        pass
+
+    def publish(self, message):
+        self.broker.deliver(message)
+
+
+class RedisBackend:
+    """
+    Fan events out to every worker through Redis pub/sub
+
+    Publishing to Redis is a network round trip, so publish() only puts
+    the message on a bounded queue, and a thread sends them on.  If
+    Redis can't keep up, new messages are dropped (and counted) rather
+    than blocking the request, or the event loop, that published them.
+    """
+
+    def __init__(self, url: str, channel: str = EVENTS_CHANNEL,
+                 max_queue: int = REDIS_QUEUE_SIZE, client=None):
+        if client is None:
+            import redis  # Optional dependency, only needed for this backend
+
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.channel = channel
+        self.broker = None
+        self.outgoing = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._pubsub = None
+        self._thread = None
+        self._sender = None
+
+    def start(self, broker):
+        self.broker = broker
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self.channel: self._on_message})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+        self._sender = threading.Thread(target=self._send, name="events-redis", daemon=True)
+        self._sender.start()
+
+    def stop(self):
+        if self._sender is not None:
+            # Sends anything already queued, then stops
+            self.outgoing.put(None)
+            self._sender.join()
+            self._sender = None
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+
+    def publish(self, message):
+        try:
+            self.outgoing.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+            log.warning("Events queue full, dropped %s event (%s dropped)",
+                        message["event"], self.dropped)
+
+    def _send(self):
+        while True:
+            message = self.outgoing.get()
+            if message is None:
+                return
+            try:
+                self.client.publish(self.channel, json.dumps(message))
+            except Exception:
+                log.exception("Failed to publish %s event to redis", message["event"])
+
+    def _on_message(self, raw):
+        try:
+            self.broker.deliver(json.loads(raw["data"]))
+        except Exception:
+            log.exception("Bad event from redis")
+
+
+def backend_from_url(url: str):
+    if not url:
+        return LocalBackend()
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBackend(url)
+    raise ValueError(f"Unknown events backend {url!r}")
+
+
+class Broker:
+    """
+    Tracks subscribers, and hands published events to the backend
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or LocalBackend()
+        self.backend.start(self)
+        # Subscribers grouped by event loop, so delivering an event
+        # costs one thread safe call per loop, not per subscriber.
+        self._subscribers: Dict[asyncio.AbstractEventLoop, Set[Subscriber]] = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def set_backend(self, backend):
+        self.backend.stop()
+        self.backend = backend
+        self.backend.start(self)
+
+    def stop(self):
+        self.backend.stop()
+
+    @property
+    def subscriber_count(self):
+        return sum(len(subs) for subs in self._subscribers.values())
+
+    def publish(self, topic: str, event: str, data: dict | None = None):
+        """
+        Publish an event on a topic.  Never blocks, on subscribers or
+        on the backend.
+        """
+        message = {
+            "id": f"{time.time_ns()}-{next(self._ids)}",
+            "topic": topic,
+            "event": event,
+            "data": data or {},
+        }
+        try:
+            self.backend.publish(message)
+        except Exception:
+            # Live updates are nice to have, never fail a request over them
+            log.exception("Failed to publish %s event", event)
+
+    def deliver(self, message):
+        """
+        Pass a message to the local subscribers (called by the backend,
+        from any thread)
+        """
+        with self._lock:
+            loops = list(self._subscribers)
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._fanout, loop, message)
+            except RuntimeError:
+                # Loop has closed
+                with self._lock:
+                    self._subscribers.pop(loop, None)
+
+    def _fanout(self, loop, message):
+        for subscriber in list(self._subscribers.get(loop, ())):
+            if subscriber.wants(message):
+                subscriber.offer(message)
+
+    def subscribe(self, topics: Iterable[str] = TOPICS,
+                  buffer_size: int = SUBSCRIBER_BUFFER,
+                  user_id: str | None = None) -> Subscriber:
+        subscriber = Subscriber(topics, buffer_size, user_id)
+        with self._lock:
+            self._subscribers.setdefault(subscriber.loop, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            subs = self._subscribers.get(subscriber.loop)
+            if subs is not None:
+                subs.discard(subscriber)
+                if not subs:
+                    del self._subscribers[subscriber.loop]
+
+
+broker = Broker()
+
+
+def publish(topic: str, event: str, data: dict | None = None):
+    """
+    Publish an event, see Broker.publish
+    """
+    broker.publish(topic, event, data)
+
+
+def start():
+    """
+    Switch to the configured backend (called from the lifespan)
+    """
+    if EVENTS_URL:
+        broker.set_backend(backend_from_url(EVENTS_URL))
+
+
+def stop():
+    broker.stop()
+
+
+def format_sse(message) -> str:
+    """
+    Format a message as a Server Sent Event
+    """
+    data = json.dumps({"topic": message["topic"], **message["data"]})
+    return f"id: {message['id']}\nevent: {message['event']}\ndata: {data}\n\n"
+
+
+async def sse_stream(subscriber: Subscriber, heartbeat: float = HEARTBEAT_SECONDS):
+    """
+    Yield Server Sent Events for a subscriber, with a comment every
+    heartbeat seconds to keep proxies from closing idle connections.
+    """
+    try:
+        # Tell the browser how long to wait before reconnecting
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(message)
+    finally:
+        broker.unsubscribe(subscriber)
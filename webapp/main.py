@@ -1,19 +1,21 @@
 from typing import Annotated
 import logging
-from fastapi import FastAPI, HTTPException, Depends, Request, Form, Response
+from fastapi import FastAPI, HTTPException, Depends, Request, Form, Response, BackgroundTasks
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 from fastapi.responses import RedirectResponse
 from contextlib import asynccontextmanager
 from sqlmodel import Session, select
 from webapp import database
+from webapp import registry
+from webapp.audit import service as audit_service
+from webapp.search import service as search_service
+from webapp.events import service as events_service
 from fastapi.security import OAuth2PasswordRequestForm
-#Setup User Routes
-from webapp.users import routes as user_routes
 from webapp.users import models as user_models
 #Authentication
 from webapp.auth import service as auth_service
+from webapp.auth.revocation import revocations
 import uuid
 
 
@@ -27,18 +29,31 @@ logger = logging.getLogger(__name__)
 @asynccontextmanager
 async def lifespan_function(app: FastAPI):
     database.create_db_and_tables()
+    for shard_engine in database.all_engines():
+        search_service.create_search_indexes(shard_engine)
+    audit_service.writer.start()
+    events_service.start()
+    revocations.start()
     yield
+    revocations.stop()
+    events_service.stop()
+    # Flush any outstanding audit events
+    audit_service.writer.stop()
 
 
 # Create a FastAPI Application
 app = FastAPI(lifespan=lifespan_function)
 
 app.mount("/static", StaticFiles(directory="webapp/static"), name="static")
-templates = Jinja2Templates(directory="webapp/templates")
 
 # Include routers for organization and modularity
-app.include_router(user_routes.router, prefix="/api/users", tags=["users"])
-# app.include_router(module_routes.router, prefix="/api/module", tags=["modules"])
+# Routers are registered by path, see webapp/registry.py
+registry.register_router("webapp.users.routes:router", prefix="/api/users", tags=["users"])
+registry.register_router("webapp.search.routes:router", prefix="/api/search", tags=["search"])
+registry.register_router("webapp.audit.routes:router", prefix="/api/audit", tags=["audit"])
+registry.register_router("webapp.modules.routes:router", prefix="/api/module", tags=["modules"])
+registry.register_router("webapp.events.routes:router", prefix="/api/events", tags=["events"])
+registry.include_routers(app)
 
 
 # Define a route
@@ -49,7 +64,7 @@ async def home(*,
     """
     Say Hello to the User.
     """
-    return templates.TemplateResponse(
+    return registry.get_templates().TemplateResponse(
         request = request, name = "index.html", context = {}
         )
 
@@ -58,7 +73,7 @@ async def home(*,
 @app.get("/login.html", response_class=HTMLResponse)
 def login_view(*,
                request: Request):
-    return templates.TemplateResponse(
+    return registry.get_templates().TemplateResponse(
         request = request, name = "login.html", context = {}
         )
 # Login view route
@@ -68,43 +83,32 @@ def handle_login_view(*,
                       session: Session = Depends(database.get_session),
                       email: Annotated[str, Form()],
                       password: Annotated[str, Form()],
+                      background_tasks: BackgroundTasks,
                       ):
 
     message = "Invalid Login"
     message_type = "alert-danger"
-    # Fetch User
-    qry = select(user_models.User).where(user_models.User.email == email)
-    result = session.exec(qry).first()
 
-    # If we have a User
-    if result:
-        #Check hashed password
-        if result.verify_password(password):
+    # Fetch the User and check their password
+    # (only once, hashing is deliberately slow)
+    valid_login = auth_service.validate_login(email, password, session, background_tasks)
 
-            valid_login = auth_service.validate_login(email, password, session)
+    if valid_login:
+        # Login Success
+        result, jwt_token = valid_login
 
-            if valid_login: 
-            # Login Success
-                stattus, jwt_token = valid_login
+        message = "Login Success"
+        message_type = "alert-success"
 
-                message = "Login Success"
-                message_type = "alert-success"
+        if result.admin:
+            redirect_url = "/admin"
+        else:
+            redirect_url = "/users"
+        user_redirect = RedirectResponse(url=redirect_url, status_code=303)
+        user_redirect.set_cookie(key="access_token", value=jwt_token, httponly=True)
+        return user_redirect
 
-                # user_email =
-
-                # the_query = select(models.User)
-                # the_user = session.exec(qry).ge
-
-                # jwt_token = auth_service.validate_login(email, password, session)
-                if result.admin:
-                    redirect_url = "/admin"
-                else:
-                    redirect_url = "/users"
-                user_redirect = RedirectResponse(url=redirect_url, status_code=303)
-                user_redirect.set_cookie(key="access_token", value=jwt_token, httponly=True)
-                return user_redirect
-
-    return templates.TemplateResponse(
+    return registry.get_templates().TemplateResponse(
         request = request, name = "login.html", context = {"message": message,
                                                            "message_type": message_type}
         )
@@ -114,6 +118,7 @@ def handle_login_view(*,
 async def get_token(
     response: Response,
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+    background_tasks: BackgroundTasks,
     session: Session = Depends(database.get_session),
 ):
     """
@@ -123,7 +128,7 @@ async def get_token(
     password = form_data.password
 
     # Get a User, and the Token from the validate_token function
-    valid_login = auth_service.validate_login(username, password, session)
+    valid_login = auth_service.validate_login(username, password, session, background_tasks)
     if not valid_login:
         raise HTTPException(401, detail="Invalid User or Password")
 
@@ -134,6 +139,7 @@ async def get_token(
 async def get_cookie(
     response: Response,
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+    background_tasks: BackgroundTasks,
     session: Session = Depends(database.get_session),
 ):
     """
@@ -143,7 +149,7 @@ async def get_cookie(
     username = form_data.username  
     password = form_data.password
 
-    valid_login = auth_service.validate_login(username, password, session)
+    valid_login = auth_service.validate_login(username, password, session, background_tasks)
     if not valid_login:
         raise HTTPException(401, detail="Invalid User or Password")
 
@@ -153,6 +159,24 @@ async def get_cookie(
     return {"access_token": token, "token_type": "bearer"}
 
 
+@app.post("/logout")
+def logout(
+    response: Response,
+    token: str = Depends(auth_service.oauth2_scheme),
+):
+    """
+    Revoke the current token (and remove the cookie if there is one)
+
+    Not async, revoking writes to the store, so run it in the threadpool
+    """
+    payload = auth_service.revoke_token(token)
+    if payload:
+        audit_service.record("logout", actor=uuid.UUID(payload["sub"]))
+
+    response.delete_cookie(key="access_token")
+    return {"ok": True}
+
+
 @app.get("/current_user")
 async def get_current_user(
         user: user_models.User = Depends(auth_service.get_user)
@@ -181,7 +205,7 @@ async def get_auth_user(
 # @app.get("/users", response_class=HTMLResponse)
 # async def user_view(*,request: Request, the_user: user_models.User = Depends(auth_service.get_user)):
 
-#     return templates.TemplateResponse(
+#     return registry.get_templates().TemplateResponse(
 #         request=request, name="users.html", context={"users": the_user}
 #     )
 
@@ -197,7 +221,7 @@ async def user_view(
  
     is_admin = "user access"
 
-    return templates.TemplateResponse(
+    return registry.get_templates().TemplateResponse(
         request=request, name="users.html", context={"user": user, "token": token, "is_admin": is_admin}
     )
 
@@ -213,12 +237,13 @@ async def admin_view(
 ):
     # user = session.get(user_models.User, user_id)
     qry = select(models.User)
-    all_users = session.exec(qry).all()
+    results = database.scatter_gather(session, lambda shard: shard.exec(qry).all())
+    all_users = [the_user for shard_users in results for the_user in shard_users]
     
     
  
     is_admin = "admin access"
 
-    return templates.TemplateResponse(
+    return registry.get_templates().TemplateResponse(
         request=request, name="admin.html", context={"user": user, "token": token, "is_admin": is_admin, "all_users": all_users}
     )
\ No newline at end of file
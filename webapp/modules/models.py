@@ -1,11 +1,11 @@
 from sqlmodel import SQLModel, Field, Relationship
-from passlib.context import CryptContext
 import uuid
 
 
 class Module(SQLModel, table=True):
     #id: int = Field(default = None, primary_key = True)
-    module_id: int = Field(primary_key=True)
+    # A UUID, so ids are unique across shards
+    module_id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     user_id: uuid.UUID = Field(foreign_key="user.id")
     module_name: str
     description: str
@@ -14,19 +14,19 @@ class Module(SQLModel, table=True):
 
 
 class PublicModule(SQLModel):
-    module_id: int
+    module_id: uuid.UUID
     module_name: str
+    complete: bool
 
 class ModuleCreate(SQLModel):
-    module_id: int 
+    user_id: uuid.UUID
     module_name: str
     description: str
-    complete: bool 
+    complete: bool = False
 
 class ModuleUpdate(SQLModel):
-    module_id: int
-    module_name: str
-    description: str
-    complete: bool 
+    module_name: str | None = None
+    description: str | None = None
+    complete: bool | None = None
  
 
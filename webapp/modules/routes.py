@@ -11,6 +11,9 @@ from fastapi import HTTPException, Depends, Request, Form
 from sqlmodel import Session, select
 
 from webapp import database
+from webapp.auth import service as auth_service
+from webapp.events import service as events
+from webapp.users.models import User
 
 # Named import of module Models
 from webapp.modules import models
@@ -21,77 +24,84 @@ log = logging.getLogger(__name__)
 router = APIRouter()
 
 
-@router.get("/", response_model = List[models.Publicmodule])
-def get_modules( *, session: Session = Depends(database.get_session)):
-    """ Get a List of modules """
-    qry = select(models.module)
-    result = session.exec(qry).all()
+@router.get("/", response_model = List[models.PublicModule])
+def get_modules( *,
+                session: Session = Depends(database.get_session),
+                user: User = Depends(auth_service.get_auth_user)):
+    """ Get a List of modules (just your own, unless you are an admin) """
+    qry = select(models.Module)
+    if not user.admin:
+        qry = qry.where(models.Module.user_id == user.id)
+    results = database.scatter_gather(session, lambda shard: shard.exec(qry).all())
 
-    return result
+    return [module for shard_modules in results for module in shard_modules]
 
 
 
-@router.get("/{item_id}", response_model = models.Publicmodule)
+@router.get("/{item_id}", response_model = models.PublicModule)
 def get_module(*,
              item_id: uuid.UUID,
-             session: Session = Depends(database.get_session)):
+             session: Session = Depends(database.get_session),
+             user: User = Depends(auth_service.get_auth_user)):
     """ Get a Specific module """
-    db_item = session.get(models.module, item_id)
+    db_item = session.get(models.Module, item_id)
     if not db_item:
         raise HTTPException(status_code = 404)
+    _check_owner(user, db_item.user_id)
     return db_item
 
 
-@router.post("/", response_model=models.Publicmodule)
+@router.post("/", response_model=models.PublicModule)
 async def create_module(
     *,
     session: Session = Depends(database.get_session),
-    new_item: models.moduleCreate
+    user: User = Depends(auth_service.get_auth_user),
+    new_item: models.ModuleCreate
     ):
     """ Create a new module in the DB """
-    # Create a new module model from the JSON supplied by the module
-    hashed_password = models.hash_password(new_item.password)
-    extra_data = {"password": hashed_password}
-
-    # Add hashed PW as extra_data when validating the model
-    db_item = models.module.model_validate(new_item, update=extra_data)        
+    _check_owner(user, new_item.user_id)
+    # Create a new module model from the JSON supplied by the user
+    db_item = models.Module.model_validate(new_item)
     # Add it to the Database and Commit
     session.add(db_item)
     session.commit()
-    
+
     # Update ID's before returning the Item
     session.refresh(db_item)
+    events.publish("modules", "module_created", _event_data(db_item))
     return db_item
 
 
-@router.patch("/{item_id}", response_model=models.Publicmodule)
+@router.patch("/{item_id}", response_model=models.PublicModule)
 async def update_module(
     *,
     session: Session = Depends(database.get_session),
+    user: User = Depends(auth_service.get_auth_user),
     item_id: uuid.UUID,
-    the_item: models.moduleUpdate,
+    the_item: models.ModuleUpdate,
 ):
     """ Update an Existing module in the DB """
     # Get the module by ID
-    db_item = session.get(models.module, item_id)
+    db_item = session.get(models.Module, item_id)
     if not db_item:
         raise HTTPException(status_code=404, detail="Not Found")
+    _check_owner(user, db_item.user_id)
 
     # Update the model from the DB
     item_data = the_item.model_dump(exclude_unset=True)
-
-    # Update the Password if it exists
-    if "password" in item_data:
-        password = item_data["password"]
-        hashed_password = models.hash_password(password)
-        item_data["password"] = hashed_password
+    was_complete = db_item.complete
 
     # Add Item to Session
     db_item.sqlmodel_update(item_data)
-    
+
     session.add(db_item)
     session.commit()
     session.refresh(db_item)
+
+    if db_item.complete and not was_complete:
+        events.publish("modules", "module_completed", _event_data(db_item))
+    else:
+        events.publish("modules", "module_updated", _event_data(db_item))
     return db_item
 
 
@@ -99,14 +109,33 @@ async def update_module(
 async def delete_module(
     *,
     session: Session = Depends(database.get_session),
+    user: User = Depends(auth_service.get_auth_user),
     item_id: uuid.UUID,
 ):
 
     """ Remove a module from  the DB """
-    db_item = session.get(models.module, item_id)
+    db_item = session.get(models.Module, item_id)
     if not db_item:
         raise HTTPException(status_code=404, detail="Not Found")
+    _check_owner(user, db_item.user_id)
 
+    data = _event_data(db_item)
     session.delete(db_item)
     session.commit()
+    events.publish("modules", "module_deleted", data)
     return {"ok": True}
+
+
+def _check_owner(user, user_id):
+    # Users can only see or change their own modules, admins can do any
+    if not user.admin and user.id != user_id:
+        raise HTTPException(status_code=403, detail="Not your module")
+
+
+def _event_data(module):
+    return {
+        "module_id": str(module.module_id),
+        "user_id": str(module.user_id),
+        "module_name": module.module_name,
+        "complete": module.complete,
+    }
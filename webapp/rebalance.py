@@ -0,0 +1,109 @@
+"""
+Offline shard rebalancing
+
+After changing WEBAPP_SHARDS, users (and their modules) need moving to
+the shard the new ring puts them on.  Stop the app first, then
+
+    python -m webapp.rebalance --from 2 --to 4
+
+Users are copied to their new shard before being deleted from the old
+one, so if the run is interrupted it can just be run again.
+Use --dry-run to see how many users would move.
+"""
+
+import argparse
+import logging
+
+from sqlmodel import SQLModel, Session, select
+
+from webapp import database
+from webapp import sharding
+from webapp.modules.models import Module
+from webapp.search import service as search_service
+from webapp.users.models import User
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def rebalance(old_count: int, new_count: int, dry_run: bool = False,
+              base_file_name: str = database.sqlite_file_name):
+    """
+    Move users from the layout for old_count shards to new_count.
+
+    Returns the number of users moved (or that would be, for a dry run).
+    """
+    # Engines for every file involved, but route with the new ring
+    files = sharding.ShardRouter(max(old_count, new_count), base_file_name)
+    new_ring = sharding.HashRing(sharding.shard_name(i) for i in range(new_count))
+
+    if not dry_run:
+        for engine in files.engines.values():
+            SQLModel.metadata.create_all(engine)
+            search_service.create_search_indexes(engine)
+
+    moved = 0
+    for index in range(old_count):
+        source_name = sharding.shard_name(index)
+        with Session(files.engines[source_name]) as source:
+            users = source.exec(select(User)).all()
+            to_move = [user for user in users if new_ring.node_for(user.id) != source_name]
+            log.info("%s: moving %s of %s users", source_name, len(to_move), len(users))
+            moved += len(to_move)
+            if dry_run:
+                continue
+
+            for start in range(0, len(to_move), BATCH_SIZE):
+                batch = to_move[start:start + BATCH_SIZE]
+                _move_batch(source, files, new_ring, batch)
+
+    return moved
+
+
+def _move_batch(source, files, ring, users):
+    """
+    Copy a batch of users (and their modules) to their new shards,
+    then remove them from the source shard.
+    """
+    targets = {}
+    for user in users:
+        target_name = ring.node_for(user.id)
+        if target_name not in targets:
+            targets[target_name] = Session(files.engines[target_name])
+        target = targets[target_name]
+
+        target.merge(User(**user.model_dump()))
+        modules = source.exec(select(Module).where(Module.user_id == user.id)).all()
+        for module in modules:
+            target.merge(Module(**module.model_dump()))
+
+    # Only delete once the copies are safely committed
+    for target in targets.values():
+        target.commit()
+        target.close()
+
+    for user in users:
+        modules = source.exec(select(Module).where(Module.user_id == user.id)).all()
+        for module in modules:
+            source.delete(module)
+        source.delete(user)
+    source.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move users between shards")
+    parser.add_argument("--from", dest="old_count", type=int, required=True,
+                        help="Number of shards the data is currently in")
+    parser.add_argument("--to", dest="new_count", type=int, required=True,
+                        help="Number of shards to spread it over")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    moved = rebalance(args.old_count, args.new_count, dry_run=args.dry_run)
+    print(f"{'Would move' if args.dry_run else 'Moved'} {moved} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Lazy registry for the expensive parts of the application
+
+Things like the password hashing context and the Jinja templates cost
+real time to build, and pull in heavy imports.  Rather than creating
+them when a module is imported, we register a factory here and the
+object is only built the first time something asks for it.
+
+Routers are registered by dotted path so main.py doesn't need to import
+every route module by name.
+"""
+
+import importlib
+import threading
+
+from typing import Any, Callable, Dict, List, Tuple
+
+TEMPLATE_DIRECTORY = "webapp/templates"
+
+_factories: Dict[str, Callable[[], Any]] = {}
+_instances: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+# (dotted path, prefix, tags)
+_routers: List[Tuple[str, str, List[str]]] = []
+
+
+def register(name: str, factory: Callable[[], Any]):
+    """
+    Register a factory for a lazily built object.
+
+    Registering an existing name replaces the factory, and forgets
+    any instance that was already built.
+    """
+    with _lock:
+        _factories[name] = factory
+        _instances.pop(name, None)
+
+
+def get(name: str):
+    """
+    Return the object registered under name, building it on first use.
+    """
+    try:
+        return _instances[name]
+    except KeyError:
+        pass
+
+    with _lock:
+        if name not in _instances:
+            if name not in _factories:
+                raise KeyError(f"Nothing registered as {name!r}")
+            _instances[name] = _factories[name]()
+        return _instances[name]
+
+
+def is_loaded(name: str) -> bool:
+    """
+    Has the object been built yet
+    """
+    return name in _instances
+
+
+def reset(name: str | None = None):
+    """
+    Forget built objects (all of them if name is None) so they are
+    rebuilt on the next get.  Mostly useful for testing.
+    """
+    with _lock:
+        if name is None:
+            _instances.clear()
+        else:
+            _instances.pop(name, None)
+
+
+def register_router(path: str, prefix: str, tags: List[str] | None = None):
+    """
+    Register a router by dotted path, eg "webapp.users.routes:router"
+    """
+    _routers.append((path, prefix, tags or []))
+
+
+def include_routers(app):
+    """
+    Import and include every registered router in the app
+    """
+    for path, prefix, tags in _routers:
+        module_name, _, attr = path.partition(":")
+        module = importlib.import_module(module_name)
+        app.include_router(getattr(module, attr or "router"), prefix=prefix, tags=tags)
+
+
+def _build_templates():
+    from fastapi.templating import Jinja2Templates
+    return Jinja2Templates(directory=TEMPLATE_DIRECTORY)
+
+
+def get_templates():
+    """
+    Shared Jinja2 templates object
+    """
+    return get("templates")
+
+
+register("templates", _build_templates)
@@ -0,0 +1,22 @@
+from typing import List
+
+from sqlmodel import SQLModel
+
+
+class SearchResult(SQLModel):
+    type: str  # "user" or "module"
+    id: str
+    title: str
+    score: float
+
+
+class SearchPage(SQLModel):
+    results: List[SearchResult]
+    # Pass back as ?after= to get the next page, None on the last page
+    next_cursor: str | None = None
+
+
+class TypeaheadResult(SQLModel):
+    type: str
+    id: str
+    title: str
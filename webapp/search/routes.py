@@ -0,0 +1,66 @@
+import logging
+from typing import List, Literal
+
+# New Import for API Routers
+from fastapi import APIRouter
+
+# As Main but without FastAPI
+from fastapi import HTTPException, Depends, Query
+
+from sqlmodel import Session
+
+from webapp import database
+from webapp.auth import service as auth_service
+from webapp.users.models import User
+
+# Named import of search Models
+from webapp.search import models
+from webapp.search import service
+
+
+log = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.get("/", response_model=models.SearchPage)
+def search(*,
+           q: str,
+           type: Literal["user", "module"] = "user",
+           limit: int = Query(default=20, ge=1, le=100),
+           after: str | None = None,
+           user: User = Depends(auth_service.get_auth_user),
+           session: Session = Depends(database.get_session)):
+    """
+    Ranked prefix search, page with the returned next_cursor
+
+    Searching users (which matches emails) is for admins only, other
+    users only find their own modules.
+    """
+    if type == "user" and not user.admin:
+        raise HTTPException(403, "Admin Access Required")
+    try:
+        return service.search(session, q, type=type, limit=limit, after=after,
+                              owner_id=_owner_id(user))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/typeahead", response_model=List[models.TypeaheadResult])
+def typeahead(*,
+              q: str,
+              limit: int = Query(default=8, ge=1, le=20),
+              user: User = Depends(auth_service.get_auth_user),
+              session: Session = Depends(database.get_session)):
+    """
+    Fast name prefix matches for search-as-you-type
+
+    Admins get users and modules, other users just their own modules.
+    """
+    types = service.SEARCH_TYPES if user.admin else ("module",)
+    return service.typeahead(session, q, types=types, limit=limit, owner_id=_owner_id(user))
+
+
+def _owner_id(user):
+    # Admins see everyone's modules
+    return None if user.admin else user.id
@@ -0,0 +1,293 @@
+"""
+Full Text Search
+
+SQLite FTS5 indexes over User (name, email) and Module (module_name,
+description), kept in step with the real tables by triggers.
+
+Both tables have UUID primary keys, and their implicit rowids can be
+renumbered by VACUUM, so each index has a small key table giving every
+row a stable integer (<index>_key, with an INTEGER PRIMARY KEY).  The
+index keeps its own copy of the text under that integer as its rowid,
+so the triggers find a row through two indexed lookups, never a scan.
+
+If an index's definition changes it is dropped and rebuilt on start up.
+
+Results are ordered by bm25 rank, and paged with a keyset cursor of
+(score, shard, rowid) so deep pages cost the same as the first.
+"""
+
+import heapq
+import itertools
+import logging
+import re
+import uuid
+
+from sqlalchemy import text
+
+from webapp import database
+from webapp.modules import models as module_models  # noqa: F401  Make sure the module table exists
+from webapp.search import models
+
+log = logging.getLogger(__name__)
+
+# index name: (table, primary key, indexed columns)
+_INDEXES = {
+    "user_fts": ("user", "id", ("name", "email")),
+    "module_fts": ("module", "module_id", ("module_name", "description")),
+}
+
+
+def _fts_ddl(name):
+    table, key, columns = _INDEXES[name]
+    # Prefix indexes make short type-ahead queries cheap
+    return (f"CREATE VIRTUAL TABLE {name} USING fts5("
+            f"{', '.join(columns)}, prefix='1 2 3')")
+
+
+def _key_ddl(name):
+    return (f"CREATE TABLE IF NOT EXISTS {name}_key ("
+            f"rid INTEGER PRIMARY KEY, id CHAR(32) NOT NULL UNIQUE)")
+
+
+def _triggers(name):
+    # Triggers are named after their index, so they can be dropped with it
+    table, key, columns = _INDEXES[name]
+    cols = ", ".join(columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    assignments = ", ".join(f"{column} = new.{column}" for column in columns)
+    rid = f"(SELECT rid FROM {name}_key WHERE id = old.{key})"
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_insert AFTER INSERT ON {table} BEGIN
+              INSERT INTO {name}_key(id) VALUES (new.{key});
+              INSERT INTO {name}(rowid, {cols})
+              VALUES ((SELECT rid FROM {name}_key WHERE id = new.{key}), {new_values});
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_delete AFTER DELETE ON {table} BEGIN
+              DELETE FROM {name} WHERE rowid = {rid};
+              DELETE FROM {name}_key WHERE id = old.{key};
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_update
+            AFTER UPDATE OF {key}, {cols} ON {table} BEGIN
+              UPDATE {name} SET {assignments} WHERE rowid = {rid};
+              UPDATE {name}_key SET id = new.{key} WHERE id = old.{key};
+            END""",
+    ]
+
+
+def _rebuild(name):
+    # Fill an index from scratch, from the existing data
+    table, key, columns = _INDEXES[name]
+    cols = ", ".join(columns)
+    return [
+        f"DELETE FROM {name}",
+        f"DELETE FROM {name}_key",
+        f"INSERT INTO {name}_key(id) SELECT {key} FROM {table}",
+        f"INSERT INTO {name}(rowid, {cols}) "
+        f"SELECT k.rid, {', '.join(f't.{column}' for column in columns)} "
+        f"FROM {name}_key k JOIN {table} t ON t.{key} = k.id",
+    ]
+
+
+# What to search, and how to get the result back out
+_SEARCHES = {
+    "user": """SELECT u.id AS id, u.name AS title, bm25(user_fts) AS score, user_fts.rowid AS rid
+               FROM user_fts
+               JOIN user_fts_key k ON k.rid = user_fts.rowid
+               JOIN user u ON u.id = k.id
+               WHERE user_fts MATCH :match""",
+    "module": """SELECT m.module_id AS id, m.module_name AS title, bm25(module_fts) AS score,
+                        module_fts.rowid AS rid
+                 FROM module_fts
+                 JOIN module_fts_key k ON k.rid = module_fts.rowid
+                 JOIN module m ON m.module_id = k.id
+                 WHERE module_fts MATCH :match""",
+}
+
+# Only show a user's own modules (used for non-admins)
+_OWNER_FILTERS = {
+    "module": " AND m.user_id = :user_id",
+}
+
+# Type-ahead only looks at the "title" column, and skips ranking
+_TYPEAHEAD = {
+    "user": ("name",
+             "SELECT u.id AS id, u.name AS title FROM user_fts "
+             "JOIN user_fts_key k ON k.rid = user_fts.rowid "
+             "JOIN user u ON u.id = k.id WHERE user_fts MATCH :match"),
+    "module": ("module_name",
+               "SELECT m.module_id AS id, m.module_name AS title FROM module_fts "
+               "JOIN module_fts_key k ON k.rid = module_fts.rowid "
+               "JOIN module m ON m.module_id = k.id WHERE module_fts MATCH :match"),
+}
+
+SEARCH_TYPES = tuple(_SEARCHES)
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def create_search_indexes(engine):
+    """
+    Create the FTS tables and triggers, if they don't exist.
+
+    Newly created indexes are populated from the existing data, and
+    any index built from an older definition is replaced.
+    """
+    with engine.begin() as conn:
+        for name in _INDEXES:
+            ddl = _fts_ddl(name)
+            existing = conn.execute(
+                text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": name}).scalar()
+            if existing == ddl:
+                continue
+            if existing is not None:
+                log.info("Search index %s has changed, rebuilding", name)
+                _drop_index(conn, name)
+            else:
+                log.info("Creating search index %s", name)
+            conn.execute(text(ddl))
+            conn.execute(text(_key_ddl(name)))
+            for statement in _rebuild(name):
+                conn.execute(text(statement))
+        for name in _INDEXES:
+            for trigger in _triggers(name):
+                conn.execute(text(trigger))
+
+
+def _drop_index(conn, name):
+    triggers = conn.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE :pattern"),
+        {"pattern": f"{name}_%"}).scalars().all()
+    for trigger in triggers:
+        conn.execute(text(f"DROP TRIGGER {trigger}"))
+    conn.execute(text(f"DROP TABLE {name}"))
+    conn.execute(text(f"DROP TABLE IF EXISTS {name}_key"))
+
+
+def rebuild_search_indexes(engine):
+    """
+    Rebuild the FTS indexes from scratch
+    """
+    with engine.begin() as conn:
+        for name in _INDEXES:
+            for statement in _rebuild(name):
+                conn.execute(text(statement))
+
+
+def to_match_query(query: str, column: str | None = None):
+    """
+    Turn user input into an FTS5 MATCH expression.
+
+    Every word must match, and the last word is treated as a prefix
+    (so results appear while typing).  Words are quoted so FTS5
+    syntax in the input can't cause errors.
+
+    Returns None if there is nothing to search for.
+    """
+    tokens = _TOKEN.findall(query)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += "*"
+    match = " AND ".join(terms)
+    if column:
+        match = f"{column} : ({match})"
+    return match
+
+
+def _encode_cursor(score, shard, rid):
+    return f"{score!r}:{shard}:{rid}"
+
+
+def _decode_cursor(cursor: str):
+    try:
+        score, shard, rid = cursor.rsplit(":", 2)
+        return float(score), int(shard), int(rid)
+    except ValueError:
+        raise ValueError(f"Invalid cursor {cursor!r}")
+
+
+def search(session, query: str, type: str = "user", limit: int = 20, after: str | None = None,
+           owner_id: uuid.UUID | None = None):
+    """
+    Ranked search of one type of item.
+
+    Each shard is searched in parallel and the results merged, ordered
+    by (score, shard, rowid).  Returns a SearchPage, with next_cursor
+    set if there may be more.
+
+    With owner_id, only modules belonging to that user are returned.
+    """
+    match = to_match_query(query)
+    if match is None:
+        return models.SearchPage(results=[])
+
+    cursor = _decode_cursor(after) if after else None
+
+    def search_shard(shard_session):
+        shard = database.shard_index(shard_session)
+        sql = _SEARCHES[type]
+        params = {"match": match, "limit": limit + 1}
+        if owner_id is not None and type in _OWNER_FILTERS:
+            sql += _OWNER_FILTERS[type]
+            params["user_id"] = owner_id.hex
+        if cursor:
+            score, cursor_shard, rid = cursor
+            # Keyset on (score, shard, rid), the shard part is known here
+            if shard < cursor_shard:
+                sql += " AND score > :score"
+            elif shard == cursor_shard:
+                sql += " AND (score > :score OR (score = :score AND rid > :rid))"
+            else:
+                sql += " AND score >= :score"
+            params.update({"score": score, "rid": rid})
+        sql += " ORDER BY score, rid LIMIT :limit"
+
+        rows = shard_session.connection().execute(text(sql), params).all()
+        return [(row.score, shard, row.rid, row) for row in rows]
+
+    rows = heapq.merge(*database.scatter_gather(session, search_shard))
+    rows = list(itertools.islice(rows, limit + 1))
+
+    results = [models.SearchResult(type=type, id=_format_id(row.id), title=row.title, score=row.score)
+               for _, _, _, row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        score, shard, rid, _ = rows[limit - 1]
+        next_cursor = _encode_cursor(score, shard, rid)
+    return models.SearchPage(results=results, next_cursor=next_cursor)
+
+
+def typeahead(session, query: str, types=SEARCH_TYPES, limit: int = 8,
+              owner_id: uuid.UUID | None = None):
+    """
+    Quick prefix match on names only, for search-as-you-type.
+
+    No ranking, this just returns the first matches the index finds.
+    owner_id limits modules to that user's, as for search().
+    """
+    if to_match_query(query) is None:
+        return []
+
+    def typeahead_shard(shard_session):
+        results = []
+        for type in types:
+            if len(results) >= limit:
+                break
+            column, sql = _TYPEAHEAD[type]
+            params = {"match": to_match_query(query, column), "limit": limit - len(results)}
+            if owner_id is not None and type in _OWNER_FILTERS:
+                sql += _OWNER_FILTERS[type]
+                params["user_id"] = owner_id.hex
+            rows = shard_session.connection().execute(text(sql + " LIMIT :limit"), params).all()
+            results.extend(models.TypeaheadResult(type=type, id=_format_id(row.id), title=row.title)
+                           for row in rows)
+        return results
+
+    shard_results = database.scatter_gather(session, typeahead_shard)
+    return list(itertools.islice(itertools.chain(*shard_results), limit))
+
+
+def _format_id(value):
+    # Ids come back as the 32 char hex SQLModel stores UUIDs as
+    return str(uuid.UUID(value))
@@ -0,0 +1,154 @@
+"""
+Sharding user data over several SQLite files
+
+SQLite only allows one writer per file, so to scale writes we spread
+users over WEBAPP_SHARDS files.  Each User, and the Modules that
+belong to them, live in the shard picked by consistent hashing of the
+user's id.  Consistent hashing means adding a shard only moves about
+1/N of the users (see webapp/rebalance.py).
+
+Shard 0 is the original database.db, so a single shard behaves exactly
+as before.  Other shards are database_shard<N>.db.
+
+When there is more than one shard, sessions are SQLAlchemy
+ShardedSessions: saving or getting a User by id goes straight to the
+right file, while other queries (eg. a login by email) run on every
+shard and the results are combined.
+"""
+
+import bisect
+import hashlib
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.ext.horizontal_shard import ShardedSession as _ShardedSession
+from sqlmodel import Session, create_engine
+
+from webapp.users.models import User
+from webapp.modules.models import Module
+
+# Points on the ring per shard, more gives a more even spread
+VIRTUAL_NODES = 64
+
+
+def shard_name(index: int) -> str:
+    return f"shard{index}"
+
+
+def shard_file_name(index: int, base_file_name: str = "database.db") -> str:
+    """
+    SQLite file for a shard.  Shard 0 is the original database file.
+    """
+    if index == 0:
+        return base_file_name
+    stem, dot, ext = base_file_name.rpartition(".")
+    return f"{stem}_shard{index}.{ext}" if dot else f"{base_file_name}_shard{index}"
+
+
+def _hash(value: bytes) -> int:
+    return int.from_bytes(hashlib.md5(value).digest()[:8], "big")
+
+
+def _key_bytes(key) -> bytes:
+    if isinstance(key, uuid.UUID):
+        return key.bytes
+    if isinstance(key, str):
+        try:
+            return uuid.UUID(key).bytes
+        except ValueError:
+            return key.encode()
+    return bytes(key)
+
+
+class HashRing:
+    """
+    Consistent hash ring, mapping keys to node names
+    """
+
+    def __init__(self, nodes, vnodes: int = VIRTUAL_NODES):
+        self.nodes = list(nodes)
+        points = sorted(
+            (_hash(f"{node}#{i}".encode()), node)
+            for node in self.nodes
+            for i in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key) -> str:
+        index = bisect.bisect(self._hashes, _hash(_key_bytes(key)))
+        return self._owners[index % len(self._owners)]
+
+
+class ShardedSession(_ShardedSession, Session):
+    """
+    SQLAlchemy's ShardedSession, with SQLModel's exec()
+    """
+
+
+class ShardRouter:
+    """
+    Engines for each shard, and which shard a user's data lives in
+    """
+
+    def __init__(self, count: int, base_file_name: str = "database.db",
+                 first_engine=None, **engine_args):
+        self.count = count
+        self.names = [shard_name(i) for i in range(count)]
+        self.engines = {}
+        for i, name in enumerate(self.names):
+            if i == 0 and first_engine is not None:
+                self.engines[name] = first_engine
+            else:
+                url = f"sqlite:///{shard_file_name(i, base_file_name)}"
+                self.engines[name] = create_engine(url, **engine_args)
+        self.ring = HashRing(self.names)
+        self._pool = None
+
+    def shard_for(self, user_id) -> str:
+        return self.ring.node_for(user_id)
+
+    def engine_for(self, user_id):
+        return self.engines[self.shard_for(user_id)]
+
+    # Hooks for ShardedSession
+    def _shard_chooser(self, mapper, instance, clause=None):
+        if isinstance(instance, User):
+            return self.shard_for(instance.id)
+        if isinstance(instance, Module):
+            return self.shard_for(instance.user_id)
+        return self.names[0]
+
+    def _identity_chooser(self, mapper, primary_key, **kwargs):
+        if mapper is not None and mapper.class_ is User:
+            return [self.shard_for(primary_key[0])]
+        # Module ids are UUIDs, unique across shards, but they don't tell
+        # us the user.  So look in every shard, at most one will have it.
+        return self.names
+
+    def _execute_chooser(self, context):
+        return self.names
+
+    def session(self) -> ShardedSession:
+        return ShardedSession(
+            shard_chooser=self._shard_chooser,
+            identity_chooser=self._identity_chooser,
+            execute_chooser=self._execute_chooser,
+            shards=self.engines,
+        )
+
+    def scatter_gather(self, fn):
+        """
+        Call fn(session) once per shard, in parallel, each with a plain
+        Session for that shard.  Returns the results in shard order.
+        """
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.count,
+                                            thread_name_prefix="shard")
+
+        def run(engine):
+            with Session(engine) as session:
+                return fn(session)
+
+        return list(self._pool.map(run, self.engines.values()))
@@ -0,0 +1,102 @@
+"""
+Cold start profiling
+
+How long does it take to import the app and run its lifespan start up.
+Each measurement is taken in a fresh interpreter, otherwise everything
+is already in sys.modules and the numbers are meaningless.
+
+Run directly for a report
+
+    python -m webapp.startup
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+# Seconds allowed for "import webapp.main" plus lifespan start up.
+# About 1.5x what we measure (~0.65s), so a real regression fails.
+STARTUP_BUDGET = float(os.environ.get("WEBAPP_STARTUP_BUDGET", "1.0"))
+
+_MEASURE_SCRIPT = """
+import asyncio, json, time
+start = time.perf_counter()
+import webapp.main
+imported = time.perf_counter()
+
+async def run_lifespan():
+    async with webapp.main.lifespan_function(webapp.main.app):
+        # Up to the yield only, shutdown isn't part of start up
+        return time.perf_counter()
+
+started = asyncio.run(run_lifespan())
+print(json.dumps({"import": imported - start, "lifespan": started - imported}))
+"""
+
+
+def _run(args, cwd=None):
+    if cwd is None:
+        # Static files and templates are relative to the project root
+        cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.run(
+        [sys.executable, *args], cwd=cwd, capture_output=True, text=True, check=True
+    )
+
+
+def measure_startup(cwd=None, repeat=1):
+    """
+    Time import and lifespan start up in a new interpreter.
+
+    With repeat, run that many times and keep the fastest, which
+    filters out noise from anything else running on the machine.
+
+    Returns a dict of {"import": secs, "lifespan": secs, "total": secs}
+    """
+    runs = []
+    for _ in range(repeat):
+        result = _run(["-c", _MEASURE_SCRIPT], cwd)
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        timings["total"] = timings["import"] + timings["lifespan"]
+        runs.append(timings)
+    return min(runs, key=lambda timings: timings["total"])
+
+
+def importtime_report(module="webapp.main", limit=20, cwd=None):
+    """
+    Use python -X importtime to find the slowest imports.
+
+    Returns a list of (cumulative_us, self_us, module) tuples,
+    slowest first.
+    """
+    result = _run(["-X", "importtime", "-c", f"import {module}"], cwd)
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        try:
+            rows.append((int(cumulative_us), int(self_us), name.strip()))
+        except ValueError:
+            # The header line
+            continue
+
+    rows.sort(reverse=True)
+    return rows[:limit]
+
+
+def main():
+    print(f"{'cumulative ms':>14} {'self ms':>10}  module")
+    for cumulative_us, self_us, name in importtime_report():
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:10.1f}  {name}")
+
+    timings = measure_startup()
+    print()
+    print(f"import   {timings['import']:.3f}s")
+    print(f"lifespan {timings['lifespan']:.3f}s")
+    print(f"total    {timings['total']:.3f}s (budget {STARTUP_BUDGET:.3f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Batched user lookups
+
+Resolving a list of user ids one GET at a time costs a session and a
+query per id.  The UserLoader collects every id asked for during the
+same tick of the event loop, removes duplicates, and fetches them
+with chunked "id IN (...)" queries (grouped by shard if we are sharded).
+
+A loader is created per request (see get_user_loader), so concurrent
+lookups of the same id within a request share one fetch, in the style
+of the DataLoader pattern.
+"""
+
+import asyncio
+import uuid
+
+from typing import Dict, Iterable, List
+
+from fastapi import Depends
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.horizontal_shard import set_shard_id
+from sqlmodel import Session, select
+
+from webapp import database
+from webapp.users.models import User
+
+# Keep well under SQLite's limit on bound parameters
+CHUNK_SIZE = 500
+
+
+def fetch_users(session: Session, user_ids: Iterable[uuid.UUID]) -> Dict[uuid.UUID, User]:
+    """
+    Fetch users by id with as few queries as possible.
+
+    Returns a dict of {id: User}, missing users are left out.
+    """
+    found = {}
+    for shard, ids in database.group_by_shard(session, user_ids).items():
+        for start in range(0, len(ids), CHUNK_SIZE):
+            chunk = ids[start:start + CHUNK_SIZE]
+            qry = select(User).where(User.id.in_(chunk))
+            if shard is not None:
+                qry = qry.options(set_shard_id(shard))
+            for user in session.exec(qry):
+                found[user.id] = user
+    return found
+
+
+class UserLoader:
+    """
+    Collects user lookups made in the same event loop tick into one batch
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+        self._results: Dict[uuid.UUID, asyncio.Future] = {}
+        self._pending: Dict[uuid.UUID, asyncio.Future] = {}
+        # Sessions aren't thread safe, only let one batch use it at a time
+        self._fetch_lock = asyncio.Lock()
+        # The loop only keeps weak references to tasks, so we hold them
+        self._tasks = set()
+
+    def load(self, user_id: uuid.UUID) -> asyncio.Future:
+        """
+        Return a future for the User (or None if they don't exist)
+        """
+        if user_id in self._results:
+            return self._results[user_id]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._results[user_id] = future
+        if not self._pending:
+            # Wait two hops of the loop, so tasks started alongside this
+            # one (eg. by asyncio.gather) can add to the batch too
+            loop.call_soon(loop.call_soon, self._dispatch)
+        self._pending[user_id] = future
+        return future
+
+    async def load_many(self, user_ids: Iterable[uuid.UUID]) -> List[User | None]:
+        """
+        Load several users, results are in the same order as user_ids
+        """
+        return await asyncio.gather(*(self.load(user_id) for user_id in user_ids))
+
+    def _dispatch(self):
+        batch, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._fetch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, batch):
+        try:
+            async with self._fetch_lock:
+                found = await run_in_threadpool(fetch_users, self.session, list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for user_id, future in batch.items():
+            if not future.done():
+                future.set_result(found.get(user_id))
+
+
+def get_user_loader(session: Session = Depends(database.get_session)):
+    """
+    Dependency giving one UserLoader per request
+    """
+    return UserLoader(session)
@@ -1,15 +1,60 @@
 from sqlmodel import SQLModel, Field, Relationship
-from passlib.context import CryptContext
 import uuid
+from typing import List
+
+from webapp import registry
+
+
+# Keyword arguments for the CryptContext, see configure_pwd_context
+# If None we use the hashing policy (webapp/auth/hashing.py)
+pwd_context_settings = None
+
+
+def _build_pwd_context():
+    # passlib is slow to import, so only pull it in when we hash something
+    from passlib.context import CryptContext
+    from webapp.auth import hashing
+
+    settings = pwd_context_settings
+    if settings is None:
+        settings = hashing.policy_settings()
+    return CryptContext(**settings)
+
+registry.register("pwd_context", _build_pwd_context)
+
+
+def configure_pwd_context(**settings):
+    """
+    Replace the CryptContext settings, eg. to use a cheap
+    scheme in the test suite.
+
+    Takes the same keyword arguments as passlib's CryptContext,
+    with no arguments we go back to the hashing policy.
+    """
+    global pwd_context_settings
+    pwd_context_settings = settings or None
+    registry.reset("pwd_context")
+
+
+def get_pwd_context():
+    """
+    Return the (lazily created) password Context
+    """
+    return registry.get("pwd_context")
+
+
+def __getattr__(name):
+    # Keep models.pwd_context working for existing callers
+    if name == "pwd_context":
+        return get_pwd_context()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-#Create password Context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def hash_password(password):
     """
     Helper Function to hash a users password
     """
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 class User(SQLModel, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key = True)
@@ -25,7 +70,20 @@ class User(SQLModel, table=True):
         """
         if password is None:  #Prob Redundant but makes it easier to jsut pass JSON
             return False
-        return pwd_context.verify(password, self.password)
+        return get_pwd_context().verify(password, self.password)
+
+    def verify_and_update_password(self, password):
+        """
+        Confirm password is correct, and check the stored hash
+        against the current hashing policy.
+
+        Returns a tuple of (valid, new_hash), where new_hash is None
+        unless the password was correct and the hash needs upgrading.
+        The new hash is NOT saved, that is up to the caller.
+        """
+        if password is None:
+            return False, None
+        return get_pwd_context().verify_and_update(password, self.password)
 
     def update_password(self, password):
         """
@@ -41,6 +99,18 @@ class PublicUser(SQLModel):
     id: uuid.UUID
     name: str
 
+class UserLookup(SQLModel):
+    id: str
+    # "found", "not_found" or "invalid" (not a UUID)
+    status: str
+    user: PublicUser | None = None
+
+class UserBatch(SQLModel):
+    results: List[UserLookup]
+
+class UserBatchRequest(SQLModel):
+    ids: List[str]
+
 class UserCreate(SQLModel):
     name: str
     email: str
@@ -6,14 +6,18 @@ from typing import List
 from fastapi import APIRouter
 
 # As Main but without FastAPI
-from fastapi import HTTPException, Depends, Request, Form
+from fastapi import HTTPException, Depends, Request, Form, Query
 
 from sqlmodel import Session, select
 
 from webapp import database
+from webapp.audit import service as audit
+from webapp.auth import service as auth_service
+from webapp.events import service as events
 
 # Named import of User Models
 from webapp.users import models
+from webapp.users.loader import UserLoader, get_user_loader
 
 
 log = logging.getLogger(__name__)
@@ -21,13 +25,80 @@ log = logging.getLogger(__name__)
 router = APIRouter()
 
 
+# Most ids a single batch request may ask for
+MAX_BATCH_IDS = 1000
+
+
+def _actor(user):
+    # Who made a change, for the audit log (None if not logged in)
+    return None if user is None else user.id
+
+
+async def _batch_get(loader, raw_ids):
+    """
+    Look up a list of ids, giving a result for each in the same order
+    """
+    if len(raw_ids) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids per request")
+
+    parsed = []
+    for raw_id in raw_ids:
+        try:
+            parsed.append(uuid.UUID(raw_id))
+        except ValueError:
+            parsed.append(None)
+
+    users = await loader.load_many([user_id for user_id in parsed if user_id is not None])
+    users = iter(users)
+
+    results = []
+    for raw_id, user_id in zip(raw_ids, parsed):
+        if user_id is None:
+            results.append(models.UserLookup(id=raw_id, status="invalid"))
+            continue
+        user = next(users)
+        if user is None:
+            results.append(models.UserLookup(id=raw_id, status="not_found"))
+        else:
+            results.append(models.UserLookup(id=raw_id, status="found",
+                                             user=models.PublicUser.model_validate(user)))
+    return models.UserBatch(results=results)
+
+
 @router.get("/", response_model = List[models.PublicUser])
 def get_users( *, session: Session = Depends(database.get_session)):
     """ Get a List of Users """
     qry = select(models.User)
-    result = session.exec(qry).all()
+    # Query every shard at once, and combine the results
+    results = database.scatter_gather(session, lambda shard: shard.exec(qry).all())
+
+    return [user for shard_users in results for user in shard_users]
+
+
+@router.get("/batch-get", response_model = models.UserBatch)
+async def get_users_batch(*,
+                          ids: List[str] = Query(),
+                          loader: UserLoader = Depends(get_user_loader)):
+    """
+    Look up many users at once, with ?ids=a,b,c (or repeated ?ids=)
+
+    See batch_get_users
+    """
+    raw_ids = [raw_id.strip() for value in ids for raw_id in value.split(",") if raw_id.strip()]
+    return await _batch_get(loader, raw_ids)
+
+
+@router.post("/batch-get", response_model = models.UserBatch)
+async def batch_get_users(*,
+                          the_item: models.UserBatchRequest,
+                          loader: UserLoader = Depends(get_user_loader)):
+    """
+    Look up many users at once.
 
-    return result
+    Results are in the same order as the ids asked for, each with a
+    status of "found", "not_found" or "invalid".
+    """
+    return await _batch_get(loader, the_item.ids)
 
 
 
@@ -46,6 +117,7 @@ def get_user(*,
 async def create_user(
     *,
     session: Session = Depends(database.get_session),
+    current_user: models.User | None = Depends(auth_service.get_user),
     new_item: models.UserCreate
     ):
     """ Create a new user in the DB """
@@ -61,6 +133,8 @@ async def create_user(
     
     # Update ID's before returning the Item
     session.refresh(db_item)
+    audit.record("user_created", actor=_actor(current_user), target=db_item.id)
+    events.publish("users", "user_created", {"id": str(db_item.id), "name": db_item.name})
     return db_item
 
 
@@ -68,6 +142,7 @@ async def create_user(
 async def update_user(
     *,
     session: Session = Depends(database.get_session),
+    current_user: models.User | None = Depends(auth_service.get_user),
     item_id: uuid.UUID,
     the_item: models.UserUpdate,
 ):
@@ -92,6 +167,10 @@ async def update_user(
     session.add(db_item)
     session.commit()
     session.refresh(db_item)
+    # Record which fields changed, but never the password itself
+    audit.record("user_updated", actor=_actor(current_user), target=db_item.id,
+                 detail=",".join(sorted(item_data)))
+    events.publish("users", "user_updated", {"id": str(db_item.id), "name": db_item.name})
     return db_item
 
 
@@ -99,6 +178,7 @@ async def update_user(
 async def delete_user(
     *,
     session: Session = Depends(database.get_session),
+    current_user: models.User | None = Depends(auth_service.get_user),
     item_id: uuid.UUID,
 ):
 
@@ -107,6 +187,10 @@ async def delete_user(
     if not db_item:
         raise HTTPException(status_code=404, detail="Not Found")
 
+    # Before the delete, users can delete themselves
+    actor = _actor(current_user)
     session.delete(db_item)
     session.commit()
+    audit.record("user_deleted", actor=actor, target=item_id)
+    events.publish("users", "user_deleted", {"id": str(item_id)})
     return {"ok": True}